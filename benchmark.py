@@ -0,0 +1,236 @@
+import argparse
+from csv import writer
+from datetime import datetime, timezone
+import json
+import logging
+import multiprocessing
+import os
+import platform
+from queue import Empty
+import random
+import resource
+import shutil
+import subprocess
+import sys
+from tempfile import gettempdir, mkdtemp
+import time
+
+from gtfs_csv_to_rdf import GtfsCsvToRdf
+
+BASE_URI = "http://example.com/gtfs#"
+STOPS_PER_TRIP = 40
+POINTS_PER_SHAPE = 200
+SCALES = {"1k": 1000, "100k": 100000, "10M": 10000000}
+FILENAMES = dict((method, filename) for filename, method in GtfsCsvToRdf.GTFS_FILES)
+
+
+def parse_scale(scale):
+    if scale in SCALES:
+        return SCALES[scale]
+    multiplier = {"k": 1000, "M": 1000000}.get(scale[-1:], 1)
+    return int(scale.rstrip("kM")) * multiplier
+
+
+def write_feed(dir_name, stop_times_rows, seed=0):
+    """Writes a synthetic but valid GTFS feed with stop_times_rows stop times and everything else in proportion."""
+    rand = random.Random(seed)
+    trips = max(1, stop_times_rows // STOPS_PER_TRIP)
+    routes = max(1, trips // 50)
+    stops = max(STOPS_PER_TRIP, stop_times_rows // 200)
+    shapes = max(1, routes * 2)
+    zones = max(1, stops // 100)
+    services = ("WEEKDAY", "SATURDAY", "SUNDAY")
+    os.makedirs(dir_name, exist_ok=True)
+    files = []
+
+    def csv_file(filename, header):
+        files.append(open(os.path.join(dir_name, filename), "w", newline="", encoding="utf-8"))
+        csv_writer = writer(files[-1])
+        csv_writer.writerow(header)
+        return csv_writer
+
+    csv_file("agency.txt", ["agency_id", "agency_name", "agency_url", "agency_timezone", "agency_lang"]).writerow(
+        ["A1", "Synthetic Transit", "http://example.com/agency", "Europe/Dublin", "en"])
+    feed = csv_file("feed_info.txt", ["publisher", "feed_publisher_name", "feed_lang", "feed_start_date",
+                                      "feed_end_date", "feed_version"])
+    feed.writerow(["http://example.com/publisher", "Synthetic Publisher", "en", "20260101", "20261231", "1"])
+
+    stop_rows = csv_file("stops.txt", ["stop_id", "stop_name", "stop_lat", "stop_lon", "zone_id", "location_type",
+                                       "wheelchair_boarding"])
+    for stop in range(stops):
+        stop_rows.writerow(["S%d" % stop, "Stop %d" % stop, "%.6f" % rand.uniform(53.2, 53.5),
+                            "%.6f" % rand.uniform(-6.5, -6.0), "Z%d" % (stop % zones), 0, rand.choice("012")])
+
+    route_rows = csv_file("routes.txt", ["route_id", "agency_id", "route_short_name", "route_long_name",
+                                         "route_type", "route_color"])
+    for route in range(routes):
+        route_rows.writerow(["R%d" % route, "A1", str(route), "Route %d" % route, rand.choice("0123"), "00AA00"])
+
+    calendar = csv_file("calendar.txt", ["service_id", "monday", "tuesday", "wednesday", "thursday", "friday",
+                                         "saturday", "sunday", "start_date", "end_date"])
+    calendar.writerow(["WEEKDAY", 1, 1, 1, 1, 1, 0, 0, "20260101", "20261231"])
+    calendar.writerow(["SATURDAY", 0, 0, 0, 0, 0, 1, 0, "20260101", "20261231"])
+    calendar.writerow(["SUNDAY", 0, 0, 0, 0, 0, 0, 1, "20260101", "20261231"])
+    calendar_dates = csv_file("calendar_dates.txt", ["service_id", "date", "exception_type"])
+    for day in ("20260317", "20261225", "20261226"):
+        calendar_dates.writerow(["WEEKDAY", day, 2])
+        calendar_dates.writerow(["SUNDAY", day, 1])
+
+    fares = csv_file("fare_attributes.txt", ["fare_id", "price", "currency_type", "payment_method", "transfers",
+                                             "transfer_duration"])
+    fare_rules = csv_file("fare_rules.txt", ["fare_id", "route_id", "origin_id", "destination_id"])
+    for route in range(routes):
+        fares.writerow(["F%d" % route, "%.2f" % rand.uniform(1, 5), "EUR", rand.choice("01"), rand.choice("012"),
+                        3600])
+        fare_rules.writerow(["F%d" % route, "R%d" % route, "Z%d" % rand.randrange(zones),
+                             "Z%d" % rand.randrange(zones)])
+
+    shape_rows = csv_file("shapes.txt", ["shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence",
+                                         "shape_dist_traveled"])
+    for shape in range(shapes):
+        lat, lon, distance = rand.uniform(53.2, 53.5), rand.uniform(-6.5, -6.0), 0.0
+        for point in range(POINTS_PER_SHAPE):
+            shape_rows.writerow(["SH%d" % shape, "%.6f" % lat, "%.6f" % lon, point + 1, "%.1f" % distance])
+            lat, lon, distance = lat + rand.uniform(-0.001, 0.001), lon + rand.uniform(-0.001, 0.001), distance + 50
+
+    trip_rows = csv_file("trips.txt", ["route_id", "service_id", "trip_id", "trip_headsign", "direction_id",
+                                       "shape_id", "wheelchair_accessible", "bikes_allowed"])
+    stop_time_rows = csv_file("stop_times.txt", ["trip_id", "arrival_time", "departure_time", "stop_id",
+                                                 "stop_sequence", "pickup_type", "drop_off_type",
+                                                 "shape_dist_traveled"])
+    frequencies = csv_file("frequencies.txt", ["trip_id", "start_time", "end_time", "headway_secs", "exact_times"])
+    written = 0
+    for trip in range(trips):
+        route = trip % routes
+        trip_rows.writerow(["R%d" % route, services[trip % len(services)], "T%d" % trip, "Route %d" % route,
+                            trip % 2, "SH%d" % (route * 2 + trip % 2), rand.choice("012"), rand.choice("012")])
+        first_stop = rand.randrange(stops)
+        seconds = rand.randrange(5 * 3600, 23 * 3600)
+        stops_on_trip = STOPS_PER_TRIP if trip < trips - 1 else max(1, stop_times_rows - written)
+        for sequence in range(stops_on_trip):
+            time_of_day = "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+            stop_time_rows.writerow(["T%d" % trip, time_of_day, time_of_day, "S%d" % ((first_stop + sequence) % stops),
+                                     sequence + 1, 0, 0, "%.1f" % (sequence * 400.0)])
+            seconds += rand.randrange(60, 180)
+        written += stops_on_trip
+        if trip % 100 == 0:
+            frequencies.writerow(["T%d" % trip, "06:00:00", "09:00:00", 600, rand.choice("01")])
+
+    transfers = csv_file("transfers.txt", ["from_stop_id", "to_stop_id", "transfer_type", "min_transfer_time"])
+    for stop in range(0, stops - 1, 10):
+        transfers.writerow(["S%d" % stop, "S%d" % (stop + 1), 2, 120])
+    for open_file in files:
+        open_file.close()
+
+
+def count_rows(path):
+    with open(path, "rb") as csv_file:
+        return sum(1 for line in csv_file if line.strip()) - 1
+
+
+def measure(feed_dir, method, options, results):
+    # times past midnight are valid GTFS but not valid xsd:time, which rdflib warns about for every literal
+    logging.getLogger("rdflib").setLevel(logging.ERROR)
+    output_dir = mkdtemp(prefix="gtfs_benchmark_")
+    try:
+        convertor = GtfsCsvToRdf(BASE_URI, os.path.join(output_dir, "output"), **options)
+        start = time.perf_counter()
+        if method == "convert_directory":
+            convertor.convert_directory(feed_dir)
+        else:
+            getattr(convertor, method)(os.path.join(feed_dir, FILENAMES[method]))
+            convertor.output()
+        wall_time = time.perf_counter() - start
+        triples = convertor.graph.triples if convertor.stream else len(convertor.graph)
+    finally:
+        shutil.rmtree(output_dir)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+    results.put({"wall_time": wall_time, "triples": triples, "peak_rss": peak_rss})
+
+
+def run(feed_dir, method, options):
+    # every measurement gets a fresh interpreter so that peak RSS is its own
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=measure, args=(feed_dir, method, options, results))
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=1)
+        except Empty:
+            if not process.is_alive():
+                # an exception or a kill, e.g. for running out of memory, ends the process without a result
+                try:
+                    result = results.get(timeout=1)
+                except Empty:
+                    break
+    process.join()
+    if result is None:
+        return {"status": "failed", "exit_code": process.exitcode}
+    result["status"] = "ok"
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    methods = [method for filename, method in GtfsCsvToRdf.GTFS_FILES] + ["convert_directory"]
+    parser = argparse.ArgumentParser(description="Benchmark gtfs_csv_to_rdf on synthetic GTFS feeds")
+    parser.add_argument("--scales", nargs="+", default=["1k", "100k"],
+                        help="stop_times.txt rows per feed, e.g. 1k 100k 10M (default: 1k 100k)")
+    parser.add_argument("--methods", nargs="+", choices=methods, default=methods, metavar="METHOD",
+                        help="convert_* methods to time, and/or convert_directory (default: all)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of each measurement (default: 1)")
+    parser.add_argument("--results", default="benchmark_results.jsonl",
+                        help="JSON lines file each result is appended to (default: benchmark_results.jsonl)")
+    parser.add_argument("--feed-dir", default=os.path.join(gettempdir(), "gtfs_benchmark_feeds"),
+                        help="where generated feeds are kept and reused between runs")
+    parser.add_argument("--format", default="n3", help="serialization format (default: n3)")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--engine", choices=GtfsCsvToRdf.ENGINES, default="rows")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    options = {"serialize": args.format, "stream": args.stream, "engine": args.engine, "workers": args.workers}
+    run_info = {"started": datetime.now(timezone.utc).isoformat(), "commit": git_commit(),
+                "python": platform.python_version(), "platform": platform.platform(), "options": options}
+    for scale in args.scales:
+        stop_times_rows = parse_scale(scale)
+        feed_dir = os.path.join(args.feed_dir, "stop_times_%d" % stop_times_rows)
+        if not os.path.isfile(os.path.join(feed_dir, "transfers.txt")):
+            print("generating %s" % feed_dir)
+            write_feed(feed_dir, stop_times_rows)
+        rows = dict((filename, count_rows(os.path.join(feed_dir, filename))) for filename in FILENAMES.values())
+        for method in args.methods:
+            if method == "convert_directory":
+                method_rows = sum(rows.values())
+            else:
+                method_rows = rows[FILENAMES[method]]
+            for repeat in range(args.repeat):
+                result = run(feed_dir, method, options)
+                result.update(run_info)
+                result.update({"scale": scale, "stop_times_rows": stop_times_rows, "method": method,
+                               "repeat": repeat, "rows": method_rows})
+                if result["status"] == "ok":
+                    result.update({"rows_per_sec": method_rows / result["wall_time"],
+                                   "triples_per_sec": result["triples"] / result["wall_time"]})
+                with open(args.results, "a") as results:
+                    results.write(json.dumps(result, sort_keys=True) + "\n")
+                if result["status"] != "ok":
+                    print("%s %s: failed with exit code %s" % (scale, method, result["exit_code"]))
+                    continue
+                print("%s %s: %.2fs, %.0f rows/s, %.0f triples/s, peak RSS %.1f MB"
+                      % (scale, method, result["wall_time"], result["rows_per_sec"], result["triples_per_sec"],
+                         result["peak_rss"] / 1048576.0))
+
+
+if __name__ == "__main__":
+    main()
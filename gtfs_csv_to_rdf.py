@@ -1,81 +1,1402 @@
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import cProfile
+from datetime import date, datetime, timedelta
+import gzip
+from hashlib import blake2b
+import heapq
+from io import BufferedReader, BufferedWriter, RawIOBase, TextIOWrapper
+import json
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
 import os
+from queue import Empty, Queue
 import shutil
+from tempfile import mkdtemp
+from threading import Event, Thread
+import time
+import tracemalloc
 from zipfile import ZipFile
 from rdflib import Graph, Namespace, RDF, Literal, XSD, URIRef
-from csv import DictReader
+from csv import DictReader, reader
 from rdflib.namespace import FOAF, DCTERMS
 from rdflib.resource import Resource
+import argparse
 import sys
 
+try:
+    import pyarrow
+    from pyarrow import compute, csv as pyarrow_csv
+except ImportError:
+    pyarrow = None
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 __author__ = 'Diarmuid'
 
+logger = logging.getLogger(__name__)
+
+
+def peak_rss():
+    """Returns the peak resident set size of this process in bytes, or None where that is not available."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class TripleStream:
+    """Stands in for a Graph, writing each triple as an N-Triples (or N-Quads) line as soon as it is added."""
+
+    def __init__(self, destination, graph_uri=None):
+        # destination is a path or a binary file such as the one PartWriter.open returns
+        if hasattr(destination, "write"):
+            self.file = TextIOWrapper(destination, encoding="utf-8")
+        else:
+            self.file = open(destination, "w", encoding="utf-8")
+        self.context = " " + URIRef(graph_uri).n3() if graph_uri is not None else ""
+        self.triples = 0
+
+    def add(self, triple):
+        self.file.write(self.line(triple))
+        self.triples += 1
+
+    def line(self, triple):
+        subject, predicate, obj = triple
+        return "%s %s %s%s .\n" % (subject.n3(), predicate.n3(), self.term(obj), self.context)
+
+    def set(self, triple):
+        # nothing already written can be replaced, so a set is just an add
+        self.add(triple)
+
+    def bind(self, prefix, namespace):
+        pass
+
+    def write(self, lines, triples):
+        self.file.write(lines)
+        self.triples += triples
+
+    def append(self, path, triples, skip=frozenset()):
+        # skip holds (subject, predicate) pairs whose lines are left out, for descriptions an earlier shard wrote
+        with open(path, encoding="utf-8") as lines:
+            if not skip:
+                shutil.copyfileobj(lines, self.file)
+            else:
+                for line in lines:
+                    if tuple(line.split(" ", 2)[:2]) in skip:
+                        triples -= 1
+                    else:
+                        self.file.write(line)
+        self.triples += triples
+
+    def flush(self):
+        """Makes sure everything added so far is on disk, and returns how many bytes that is."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.buffer.tell()
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def term(node):
+        if not isinstance(node, Literal):
+            return node.n3()
+        encoded = '"%s"' % node.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"').replace("\r", "\\r")
+        if node.language:
+            return encoded + "@" + node.language
+        if node.datatype:
+            # formatted rather than concatenated, as adding a str to a URIRef makes a new (invalid) URIRef
+            return "%s^^<%s>" % (encoded, node.datatype)
+        return encoded
+
+
+class PipelineQueue(Queue):
+    """Bounded queue between two pipeline stages, keeping track of how full it gets and how long each side waits."""
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.batches = 0
+        self.max_depth = 0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    def put(self, item, block=True, timeout=None):
+        start = time.perf_counter()
+        super().put(item, block, timeout)
+        self.put_wait += time.perf_counter() - start
+        self.batches += 1
+        self.max_depth = max(self.max_depth, self.qsize())
+
+    def get(self, block=True, timeout=None):
+        start = time.perf_counter()
+        item = super().get(block, timeout)
+        self.get_wait += time.perf_counter() - start
+        return item
+
+    def stats(self):
+        return {"maxsize": self.maxsize, "depth": self.qsize(), "max_depth": self.max_depth, "batches": self.batches}
+
+
+class PipelinedTripleStream(TripleStream):
+    """TripleStream that hands triples over in batches to a writer thread, which formats and writes them."""
+
+    BATCH_SIZE = 4096
+
+    def __init__(self, destination, graph_uri=None, queue_size=8):
+        super().__init__(destination, graph_uri)
+        self.pending = []
+        self.queue = PipelineQueue(queue_size)
+        self.busy = 0.0
+        self.error = None
+        self.thread = Thread(target=self.__write_batches, name="gtfs-triple-writer", daemon=True)
+        self.thread.start()
+
+    def add(self, triple):
+        self.pending.append(triple)
+        self.triples += 1
+        if len(self.pending) >= self.BATCH_SIZE:
+            self.__hand_over()
+
+    def write(self, lines, triples):
+        self.__hand_over()
+        self.queue.put(lines)
+        self.triples += triples
+
+    def append(self, path, triples, skip=frozenset()):
+        # the shard is copied straight into the file, so everything queued before it has to be written first
+        self.drain()
+        super().append(path, triples, skip)
+
+    def drain(self):
+        self.__hand_over()
+        self.queue.join()
+        self.__raise()
+
+    def flush(self):
+        self.drain()
+        return super().flush()
+
+    def close(self):
+        self.__hand_over()
+        self.queue.put(None)
+        self.thread.join()
+        super().close()
+        self.__raise()
+
+    def stats(self):
+        return {"busy": self.busy, "waiting": self.queue.get_wait, "queue": self.queue.stats()}
+
+    def __hand_over(self):
+        self.__raise()
+        if self.pending:
+            self.queue.put(self.pending)
+            self.pending = []
+
+    def __raise(self):
+        if self.error is not None:
+            raise self.error
+
+    def __write_batches(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    start = time.perf_counter()
+                    self.file.write(item if isinstance(item, str) else "".join(map(self.line, item)))
+                    self.busy += time.perf_counter() - start
+            except Exception as error:
+                # raised on the converting thread the next time it hands something over
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+
+class BatchedGraph(Graph):
+    """Graph on a persistent rdflib store that adds triples to it, and commits, batch_size triples at a time.
+
+    Like a stream, a set only replaces values that are still waiting in the current batch.
+    """
+
+    def __init__(self, store, identifier, batch_size):
+        super().__init__(store=store, identifier=identifier)
+        self.batch_size = batch_size
+        self.pending = {}
+        self.pending_triples = 0
+        self.commits = 0
+
+    def add(self, triple):
+        subject, predicate, obj = triple
+        objects = self.pending.setdefault((subject, predicate), set())
+        if obj not in objects:
+            objects.add(obj)
+            self.pending_triples += 1
+            if self.pending_triples >= self.batch_size:
+                self.flush()
+        return self
+
+    def set(self, triple):
+        subject, predicate, obj = triple
+        self.pending_triples -= len(self.pending.pop((subject, predicate), ()))
+        return self.add(triple)
+
+    def __len__(self):
+        return super().__len__() + self.pending_triples
+
+    def flush(self):
+        self.addN((subject, predicate, obj, self) for (subject, predicate), objects in self.pending.items()
+                  for obj in objects)
+        self.commit()
+        self.pending = {}
+        self.pending_triples = 0
+        self.commits += 1
+
+    def close(self, commit_pending_transaction=False):
+        self.flush()
+        super().close(commit_pending_transaction)
+
+
+class LruCache:
+    """Dictionary with an optional size limit, past which the least recently used entry is evicted."""
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if self.maxsize is not None:
+                self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if self.maxsize is not None and len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class ByteRange(RawIOBase):
+    """Read-only view of the bytes from start up to end of a seekable binary file."""
+
+    def __init__(self, raw, start, end):
+        raw.seek(start)
+        self.raw = raw
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(min(len(buffer), self.remaining))
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+class PartWriter(RawIOBase):
+    """Write-only file that compresses what is written and rolls it over into numbered part files.
+
+    Parts are only ever cut after a newline, so with a line based format like N-Triples each part is complete on its
+    own and holds as many triples as lines. Compressing and writing to disk happens on a background thread, which
+    zlib and zstandard let run alongside the conversion. A manifest of the parts is written when the file is closed.
+    """
+
+    COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+    BUFFER_SIZE = 1 << 20
+    QUEUE_SIZE = 16
+
+    def __init__(self, path, compression=None, part_bytes=None, part_triples=None, level=None):
+        if compression is not None and compression not in self.COMPRESSIONS:
+            raise ValueError("compression must be one of %s, not %s" % (tuple(self.COMPRESSIONS), compression))
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compression needs the zstandard package")
+        suffix = self.COMPRESSIONS.get(compression, "")
+        if suffix and path.endswith(suffix):
+            path = path[:-len(suffix)]
+        self.path = path
+        self.compression = compression
+        self.suffix = suffix
+        self.part_bytes = part_bytes
+        self.part_triples = part_triples
+        self.level = level
+        self.parts = []
+        self.part = None
+        self.pending = b""
+        self.queue = Queue(self.QUEUE_SIZE)
+        self.error = None
+        self.thread = Thread(target=self.__compress, name="gtfs-output-writer", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def open(cls, path, compression=None, part_bytes=None, part_triples=None, level=None):
+        """Returns a buffered binary file writing to path through a PartWriter."""
+        return BufferedWriter(cls(path, compression, part_bytes, part_triples, level), buffer_size=cls.BUFFER_SIZE)
+
+    def rotates(self):
+        return self.part_bytes is not None or self.part_triples is not None
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        # the buffer handed in may be reused by the caller once this returns
+        data = bytes(data)
+        written = len(data)
+        if self.rotates():
+            # only whole lines are handed on, the rest waits for the write that ends its line
+            data = self.pending + data
+            end = data.rfind(b"\n") + 1
+            data, self.pending = data[:end], data[end:]
+        self.__write_lines(data)
+        return written
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.__write_lines(self.pending)
+            if self.part is None and not self.parts:
+                self.__open_part()
+            if self.part is not None:
+                self.__close_part()
+            self.queue.put(None)
+            self.thread.join()
+            if self.error is not None:
+                raise self.error
+            if self.rotates():
+                self.__write_manifest()
+        finally:
+            super().close()
+
+    def __write_lines(self, data):
+        while data:
+            if self.part is None:
+                self.__open_part()
+            cut = self.__cut(data)
+            self.__put(data[:cut])
+            data = data[cut:]
+            if data:
+                self.__close_part()
+
+    def __cut(self, data):
+        # how much of data still fits in the current part, rounded down to the end of a line
+        if not self.rotates():
+            return len(data)
+        fits = len(data)
+        if self.part_bytes is not None:
+            fits = min(fits, max(0, self.part_bytes - self.part["bytes"]))
+        if self.part_triples is not None and data.count(b"\n") >= self.part_triples - self.part["triples"]:
+            end = -1
+            for line in range(self.part_triples - self.part["triples"]):
+                end = data.find(b"\n", end + 1)
+                if end < 0 or end >= fits:
+                    break
+            else:
+                fits = end + 1
+        if fits == len(data):
+            return fits
+        cut = data.rfind(b"\n", 0, fits) + 1
+        if cut == 0 and self.part["bytes"] == 0:
+            # a single line longer than a whole part still has to go somewhere
+            cut = data.find(b"\n") + 1 or len(data)
+        return cut
+
+    def __put(self, data):
+        if data:
+            self.part["bytes"] += len(data)
+            self.part["triples"] += data.count(b"\n")
+            self.queue.put(data)
+
+    def __open_part(self):
+        if self.rotates():
+            root, extension = os.path.splitext(self.path)
+            path = "%s.%05d%s%s" % (root, len(self.parts), extension, self.suffix)
+        else:
+            path = self.path + self.suffix
+        self.part = {"path": path, "bytes": 0, "triples": 0}
+        self.queue.put(path)
+
+    def __close_part(self):
+        self.parts.append(self.part)
+        self.part = None
+
+    def __open_compressed(self, path):
+        if self.compression == "gzip":
+            return gzip.open(path, "wb", compresslevel=6 if self.level is None else self.level)
+        if self.compression == "zstd":
+            compressor = zstandard.ZstdCompressor(level=3 if self.level is None else self.level)
+            return compressor.stream_writer(open(path, "wb"))
+        return open(path, "wb")
+
+    def __compress(self):
+        # runs on the writer thread: a path starts a new part file, bytes are written to the current one
+        output = None
+        while True:
+            item = self.queue.get()
+            if self.error is not None:
+                # keep taking what is queued so that write and close do not block, the error is raised there
+                if item is None:
+                    return
+                continue
+            try:
+                if item is None or isinstance(item, str):
+                    if output is not None:
+                        output.close()
+                    if item is None:
+                        return
+                    output = self.__open_compressed(item)
+                else:
+                    output.write(item)
+            except Exception as error:
+                self.error = error
+                if item is None:
+                    return
+
+    def __write_manifest(self):
+        root, extension = os.path.splitext(self.path)
+        parts = [{"path": os.path.basename(part["path"]), "bytes": part["bytes"], "triples": part["triples"],
+                  "size": os.path.getsize(part["path"])} for part in self.parts]
+        manifest = {"compression": self.compression, "parts": parts,
+                    "bytes": sum(part["bytes"] for part in parts), "triples": sum(part["triples"] for part in parts)}
+        with open(root + ".manifest.json", "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+
+class LineSorter:
+    """Sorts the lines of a file and drops duplicates without holding more than about memory_limit bytes of them.
+
+    Lines are read into runs of at most memory_limit, each sorted and written to a temporary file, and the runs are
+    then merged. Lines compare by code point, which is the byte order of their UTF-8 encoding.
+    """
+
+    # roughly what a str and its list entry take on top of its characters
+    LINE_OVERHEAD = 64
+    # most runs merged at once, more are merged in several passes to stay clear of open file limits
+    MERGE_WIDTH = 128
+
+    def __init__(self, memory_limit=1 << 28, temp_dir=None):
+        self.memory_limit = memory_limit
+        self.temp_dir = temp_dir
+        self.runs = 0
+        self.lines_read = 0
+        self.lines_written = 0
+
+    def sort(self, path, destination):
+        """Writes the sorted, distinct lines of the file at path to the text file destination."""
+        run_dir = mkdtemp(prefix="gtfs_sort_", dir=self.temp_dir)
+        try:
+            runs = []
+            with open(path, encoding="utf-8") as lines:
+                run, size = [], 0
+                for line in lines:
+                    run.append(line)
+                    size += len(line) + self.LINE_OVERHEAD
+                    if size >= self.memory_limit:
+                        runs.append(self.__spill(run, run_dir, len(runs)))
+                        run, size = [], 0
+            if not runs:
+                # everything fit in memory, so there is nothing to merge
+                self.lines_read += len(run)
+                self.__write(sorted(set(run)), destination)
+                return
+            runs.append(self.__spill(run, run_dir, len(runs)))
+            del run
+            while len(runs) > self.MERGE_WIDTH:
+                merged = []
+                for start in range(0, len(runs), self.MERGE_WIDTH):
+                    merged_path = os.path.join(run_dir, "merged_%05d_%05d" % (len(runs), start))
+                    with open(merged_path, "w", encoding="utf-8") as merged_file:
+                        self.__merge(runs[start:start + self.MERGE_WIDTH], merged_file)
+                    merged.append(merged_path)
+                runs = merged
+            self.lines_written = 0
+            self.__merge(runs, destination)
+        finally:
+            shutil.rmtree(run_dir)
+
+    def __merge(self, runs, destination):
+        run_files = [open(run_path, encoding="utf-8", buffering=1 << 16) for run_path in runs]
+        try:
+            self.__write(heapq.merge(*run_files), destination)
+        finally:
+            for run_file in run_files:
+                run_file.close()
+            for run_path in runs:
+                os.remove(run_path)
+
+    def __spill(self, run, run_dir, num):
+        self.lines_read += len(run)
+        self.runs += 1
+        run_path = os.path.join(run_dir, "run_%05d" % num)
+        with open(run_path, "w", encoding="utf-8") as run_file:
+            run_file.writelines(sorted(set(run)))
+        return run_path
+
+    def __write(self, lines, destination):
+        previous = None
+        for line in lines:
+            if line != previous:
+                destination.write(line)
+                self.lines_written += 1
+                previous = line
+
+
+class ColumnarEngine:
+    """Converts stop_times.txt and shapes.txt a batch of columns at a time with pyarrow.
+
+    The lines written are byte for byte the ones convert_stop_times and convert_shapes stream row by row, including
+    where the type and identifier of a newly seen trip, stop or shape appear. Non-string literals are built with
+    rdflib once per distinct value, so a change to the literals built by those methods must be made here as well.
+
+    pyarrow has no equivalent of the csv module's skipinitialspace, so from the first batch with a quoted value after
+    spaces the rest of the file is left to the row by row methods, starting at fallback_rows.
+    """
+
+    BLOCK_SIZE = 1 << 22
+    TERM_CACHE_SIZE = 1 << 16
+    INVALID_URI_CHARACTERS = '[<>" {}|\\\\^`]'
+
+    def __init__(self, convertor, id_filter=None):
+        self.convertor = convertor
+        self.uri = convertor.uri
+        self.suffix = convertor.graph.context + " .\n"
+        self.terms = {}
+        self.fallback_rows = None
+        # (column, ids) of the rows to keep, see GtfsCsvToRdf.resolve_filters
+        self.id_filter = id_filter
+        if id_filter is not None:
+            self.id_filter = (id_filter[0], pyarrow.array(sorted(id_filter[1]), pyarrow.string()))
+
+    def convert_stop_times(self, fieldnames, csv_file):
+        gtfs = self.convertor.GTFS
+        for batch in self.__batches(fieldnames, csv_file):
+            trip_id = self.__column(batch, "trip_id")
+            stop_id = self.__column(batch, "stop_id")
+            sequence_num = self.__column(batch, "stop_sequence")
+            stop_time = self.__uri(self.uri, trip_id, "_", stop_id, "_StopTime_", sequence_num)
+            (trip, trip_descriptions, trip_triples), (stop, stop_descriptions, stop_triples) = self.__entities(
+                ("trip_", trip_id, gtfs.Trip), ("stop_", stop_id, None))
+            lines = [self.__line(stop_time, RDF.type, gtfs.StopTime),
+                     trip_descriptions,
+                     self.__line(stop_time, gtfs.trip, trip),
+                     self.__line(stop_time, gtfs.arrivalTime, self.__literals(batch, "arrival_time", XSD.time)),
+                     self.__line(stop_time, gtfs.departureTime, self.__literals(batch, "departure_time", XSD.time)),
+                     stop_descriptions,
+                     self.__line(stop_time, gtfs.stop, stop),
+                     self.__line(stop_time, gtfs.stopSequence,
+                                 self.__literals(batch, "stop_sequence", XSD.nonNegativeInteger))]
+            if "stop_headsign" in fieldnames:
+                lines.append(self.__line(stop_time, gtfs.headsign, self.__literals(batch, "stop_headsign", XSD.string)))
+            if "pickup_type" in fieldnames:
+                lines.append(self.__line(stop_time, gtfs.pickupType, self.__terms(
+                    "pickup_type", self.__column(batch, "pickup_type"), self.convertor.get_stop_type)))
+            if "drop_off_type" in fieldnames:
+                lines.append(self.__line(stop_time, gtfs.dropOffType, self.__terms(
+                    "drop_off_type", self.__column(batch, "drop_off_type"), self.convertor.get_stop_type)))
+            triples = (len(lines) - 2) * len(batch) + trip_triples + stop_triples
+            if "shape_dist_traveled" in fieldnames:
+                distances = self.__column(batch, "shape_dist_traveled")
+                present = compute.not_equal(distances, "")
+                # empty distances get a placeholder term, the lines they end up in are dropped
+                lines.append(compute.if_else(present, self.__line(stop_time, gtfs.distanceTraveled, self.__terms(
+                    "shape_dist_traveled", distances,
+                    lambda value: self.convertor.get_distance_literal(value) if value else Literal(value))), ""))
+                triples += compute.sum(present).as_py() or 0
+            self.__write(lines, triples)
+
+    def convert_shapes(self, fieldnames, csv_file):
+        gtfs, geo = self.convertor.GTFS, self.convertor.GEO
+        for batch in self.__batches(fieldnames, csv_file):
+            shape_id = self.__column(batch, "shape_id")
+            shape_point = self.__uri(self.uri, "shape_", shape_id, "_", self.__column(batch, "shape_pt_sequence"))
+            (shape, shape_descriptions, shape_triples), = self.__entities(("shape_", shape_id, gtfs.Shape))
+            lines = [shape_descriptions,
+                     self.__line(shape, gtfs.shapePoint, shape_point),
+                     self.__line(shape_point, RDF.type, gtfs.ShapePoint),
+                     self.__line(shape_point, geo.long, self.__literals(batch, "shape_pt_lon", XSD.string)),
+                     self.__line(shape_point, geo.lat, self.__literals(batch, "shape_pt_lat", XSD.string)),
+                     self.__line(shape_point, gtfs.pointSequence,
+                                 self.__literals(batch, "shape_pt_sequence", XSD.nonNegativeInteger))]
+            triples = (len(lines) - 1) * len(batch) + shape_triples
+            if "shape_dist_traveled" in fieldnames:
+                present = compute.not_equal(self.__column(batch, "shape_dist_traveled"), "")
+                distances = self.__literals(batch, "shape_dist_traveled", XSD.nonNegativeInteger)
+                lines.append(compute.if_else(present, self.__line(shape_point, gtfs.distanceTraveled, distances), ""))
+                triples += compute.sum(present).as_py() or 0
+            self.__write(lines, triples)
+
+    def __batches(self, fieldnames, csv_file):
+        # rows converted before the checkpoint being resumed from are skipped by the reader
+        skip, self.convertor.resume_rows = self.convertor.resume_rows, 0
+        done = skip
+        read_options = pyarrow_csv.ReadOptions(column_names=fieldnames, block_size=self.BLOCK_SIZE,
+                                               skip_rows_after_names=skip)
+        convert_options = pyarrow_csv.ConvertOptions(column_types={name: pyarrow.string() for name in fieldnames},
+                                                     strings_can_be_null=False, quoted_strings_can_be_null=False)
+        try:
+            with csv_file, pyarrow_csv.open_csv(csv_file, read_options=read_options,
+                                                convert_options=convert_options) as batches:
+                for batch in batches:
+                    if any(self.__quoted_after_spaces(column) for column in batch.columns):
+                        break
+                    self.convertor.checkpoint_rows(done)
+                    done += len(batch)
+                    self.convertor.add_rows(len(batch))
+                    if self.id_filter is not None and len(batch):
+                        column, ids = self.id_filter
+                        batch = batch.filter(compute.is_in(self.__column(batch, column), value_set=ids))
+                    if len(batch):
+                        yield batch
+                else:
+                    return
+        except pyarrow.ArrowInvalid:
+            # e.g. a comma in a quoted value after spaces, which gives pyarrow one column too many
+            pass
+        logger.info("quoted values after spaces, converting the rest from row %d row by row", done)
+        self.fallback_rows = done
+
+    @staticmethod
+    def __quoted_after_spaces(column):
+        # the regular expression only runs on the rare columns with a value starting with a space
+        return compute.any(compute.starts_with(column, " ")).as_py() and \
+            compute.any(compute.match_substring_regex(column, '^ +"')).as_py()
+
+    @staticmethod
+    def __column(batch, name):
+        return compute.utf8_trim_whitespace(batch.column(name))
+
+    @staticmethod
+    def __join(*parts):
+        return compute.binary_join_element_wise(*parts, "")
+
+    def __uri(self, *parts):
+        uris = self.__join(*parts)
+        # rdflib refuses to serialize these, which stops the row by row path, so stop here as well
+        invalid = compute.match_substring_regex(uris, self.INVALID_URI_CHARACTERS)
+        if compute.any(invalid).as_py():
+            raise Exception('"%s" does not look like a valid URI, I cannot serialize this as N3/Turtle. Perhaps you '
+                            'wanted to urlencode it?' % uris.filter(invalid)[0].as_py())
+        return self.__join("<", uris, ">")
+
+    def __line(self, subject, predicate, obj):
+        if isinstance(obj, URIRef):
+            return self.__join(subject, " %s %s%s" % (predicate.n3(), obj.n3(), self.suffix))
+        return self.__join(subject, " %s " % predicate.n3(), obj, self.suffix)
+
+    def __literals(self, batch, name, datatype):
+        if datatype != XSD.string:
+            return self.__terms(name, self.__column(batch, name), lambda value: Literal(value, datatype=datatype))
+        # string literals keep their lexical form, so they only need the escaping TripleStream.term does
+        escaped = self.__column(batch, name)
+        for character, escape in (("\\", "\\\\"), ("\n", "\\n"), ('"', '\\"'), ("\r", "\\r")):
+            escaped = compute.replace_substring(escaped, character, escape)
+        return self.__join('"', escaped, '"^^<%s>' % XSD.string)
+
+    def __terms(self, name, values, to_term):
+        # each distinct value in the batch is encoded once, and recently used encodings are kept between batches
+        cache = self.terms.setdefault(name, LruCache(self.TERM_CACHE_SIZE))
+        encoded = values.dictionary_encode()
+        terms = []
+        for value in encoded.dictionary.to_pylist():
+            term = cache.get(value)
+            if term is None:
+                term = TripleStream.term(to_term(value))
+                cache.put(value, term)
+            terms.append(term)
+        return compute.take(pyarrow.array(terms, pyarrow.string()), encoded.indices)
+
+    def __entities(self, *kinds):
+        # kinds are (prefix, ids, rdf_type) in the order the row by row path looks up each row's entities
+        cache = self.convertor.entities
+        if cache.maxsize is None:
+            # without eviction only the first row with an id that is not interned yet gets its description
+            results = []
+            for prefix, ids, rdf_type in kinds:
+                encoded = ids.dictionary_encode()
+                descriptions = ["" if prefix + entity_id in cache.entries
+                                else self.__describe(prefix, entity_id, rdf_type)
+                                for entity_id in encoded.dictionary.to_pylist()]
+                new = sum(1 for description in descriptions if description)
+                cache.hits += len(ids) - new
+                cache.misses += new
+                # the dictionary is in order of first appearance, so a row is the first with its id when its index
+                # is higher than any before it
+                indices = encoded.indices
+                highest = compute.cumulative_max(indices)
+                first = compute.greater(indices, pyarrow.concat_arrays(
+                    [pyarrow.array([-1], indices.type), highest.slice(0, len(highest) - 1)]))
+                results.append((compute.if_else(
+                    first, compute.take(pyarrow.array(descriptions, pyarrow.string()), indices), ""), new))
+        else:
+            # with eviction the cache has to see the lookups in exactly the order the rows make them
+            descriptions = [[] for kind in kinds]
+            news = [0 for kind in kinds]
+            for entity_ids in zip(*[ids.to_pylist() for prefix, ids, rdf_type in kinds]):
+                for num, entity_id in enumerate(entity_ids):
+                    prefix, ids, rdf_type = kinds[num]
+                    if cache.get(prefix + entity_id) is None:
+                        descriptions[num].append(self.__describe(prefix, entity_id, rdf_type))
+                        news[num] += 1
+                    else:
+                        descriptions[num].append("")
+            results = [(pyarrow.array(texts, pyarrow.string()), new) for texts, new in zip(descriptions, news)]
+        return [(self.__uri(self.uri, prefix, ids), descriptions, new * (1 if rdf_type is None else 2))
+                for (prefix, ids, rdf_type), (descriptions, new) in zip(kinds, results)]
+
+    def __describe(self, prefix, entity_id, rdf_type):
+        uri = URIRef(self.uri + prefix + entity_id)
+        self.convertor.entities.put(prefix + entity_id, Resource(self.convertor.graph, uri))
+        description = "%s %s %s%s" % (uri.n3(), DCTERMS.identifier.n3(),
+                                      TripleStream.term(Literal(entity_id, datatype=XSD.string)), self.suffix)
+        if rdf_type is not None:
+            description = "%s %s %s%s" % (uri.n3(), RDF.type.n3(), rdf_type.n3(), self.suffix) + description
+        return description
+
+    def __write(self, lines, triples):
+        # the value buffer of a string array holds its values back to back, which is exactly the text to write
+        text = self.__join(*lines)
+        offsets = pyarrow.Array.from_buffers(pyarrow.int32(), len(text) + 1, [None, text.buffers()[1]],
+                                             offset=text.offset)
+        start, end = offsets[0].as_py(), offsets[len(text)].as_py()
+        self.convertor.graph.write(text.buffers()[2].slice(start, end - start).to_pybytes().decode("utf-8"),
+                                   triples)
+
+
+def _convert_chunk(options, known_entities, id_filters, csv_filename, method, byte_range, shard):
+    convertor = GtfsCsvToRdf(output_file=shard, **options)
+    for key in known_entities:
+        convertor.entities.put(key, Resource(convertor.graph, URIRef(convertor.uri + key)))
+    convertor.id_filters = id_filters
+    convertor.byte_range = byte_range
+    getattr(convertor, method)(csv_filename)
+    convertor.output()
+    known = set(known_entities)
+    return (convertor.rows_read, convertor.graph.triples,
+            [key for key in convertor.entities.entries if key not in known])
+
+
+def _convert_feed(feed, options):
+    # runs in a GtfsBatch worker process, so a failing feed is reported instead of ending the batch
+    report = dict(feed, status="ok", error=None)
+    start = time.perf_counter()
+    try:
+        convertor = GtfsCsvToRdf(feed["uri"], feed["output_file"], graph_uri=feed["graph"], **options)
+        if os.path.isdir(feed["source"]):
+            convertor.convert_directory(feed["source"])
+        else:
+            convertor.open_zip(feed["source"])
+        stats = convertor.stats()
+        report.update(rows=stats["total"]["rows"], triples=stats["total"]["triples"], stages=stats["stages"])
+    except Exception as error:
+        logger.exception("%s failed", feed["name"])
+        report.update(status="error", error="%s: %s" % (type(error).__name__, error))
+    report.update(seconds=time.perf_counter() - start, peak_rss=peak_rss())
+    return report
+
+
+def _send_feed_report(feed, options, connection):
+    connection.send(_convert_feed(feed, options))
+    connection.close()
+
 
 class GtfsCsvToRdf:
 
     GEO = Namespace("http://www.w3.org/2003/01/geo/wgs84_pos#")
     SCHEMA = Namespace("http://schema.org/")
     GTFS = Namespace("http://vocab.gtfs.org/terms#")
+    GEOSPARQL = Namespace("http://www.opengis.net/ont/geosparql#")
 
-    def __init__(self, uri, output_file, zip_file=None, serialize='n3'):
+    STREAM_FORMATS = ("nt", "nquads")
+    ENGINES = ("rows", "columnar")
+    SHAPE_GEOMETRIES = ("points", "wkt")
+    READ_BATCH_SIZE = 1000
+    PIPELINE_QUEUE_SIZE = 8
+    GTFS_FILES = (("agency.txt", "convert_agency"), ("stops.txt", "convert_stops"), ("routes.txt", "convert_routes"),
+                  ("trips.txt", "convert_trips"), ("stop_times.txt", "convert_stop_times"),
+                  ("calendar.txt", "convert_calendar"), ("calendar_dates.txt", "convert_calendar_dates"),
+                  ("fare_attributes.txt", "convert_fare_attributes"), ("fare_rules.txt", "convert_fare_rules"),
+                  ("shapes.txt", "convert_shapes"), ("frequencies.txt", "convert_frequencies"),
+                  ("transfers.txt", "convert_transfers"), ("feed_info.txt", "convert_feed"))
+
+    # GTFS enum codes to their linked-GTFS terms, with what an unknown or missing code maps to kept alongside
+    WHEELCHAIR_ACCESSIBLE = {"1": GTFS.WheelchairAccessible, "2": GTFS.NotWheelchairAccessible}
+    WHEELCHAIR_ACCESSIBLE_DEFAULT = GTFS.CheckParentStation
+    STOP_TYPES = {"": GTFS.Regular, "0": GTFS.Regular, "1": GTFS.NotAvailable, "2": GTFS.MustPhone,
+                  "3": GTFS.MustCoordinateWithDriver}
+    STOP_TYPES_DEFAULT = GTFS.NotAvailable
+    PAYMENT_METHODS = {"0": GTFS.OnBoard}
+    PAYMENT_METHODS_DEFAULT = GTFS.BeforeBoarding
+    TRANSFERS = {"0": GTFS.NoTransfersAllowed, "1": GTFS.OneTransfersAllowed, "2": GTFS.TwoTransfersAllowed}
+    TRANSFERS_DEFAULT = GTFS.UnlimitedTransfersAllowed
+    TRANSFER_TYPES = {"1": GTFS.EnsuredTransfer, "2": GTFS.MinimumTimeTransfer, "3": GTFS.NoTransfer}
+    TRANSFER_TYPES_DEFAULT = GTFS.RecommendedTransfer
+    BIKES_ALLOWED = {"1": Literal(True, datatype=XSD.boolean)}
+    BIKES_ALLOWED_DEFAULT = Literal(False, datatype=XSD.boolean)
+    # a stop's type comes from its location_type instead
+    ENTITY_TYPES = {"agency_": GTFS.Agency, "stop_": None, "zone_": GTFS.Zone, "route_": GTFS.Route,
+                    "trip_": GTFS.Trip, "service_": GTFS.Service, "shape_": GTFS.Shape, "fare_": GTFS.FareClass}
+
+    def __init__(self, uri, output_file, zip_file=None, serialize='n3', stream=False, entity_cache_size=None,
+                 workers=1, engine="rows", store=None, store_path=None, batch_size=10000, progress=None,
+                 progress_interval=100000, profile_dir=None, trace_memory=False, literal_cache_size=1 << 16,
+                 compression=None, compression_level=None, part_bytes=None, part_triples=None, graph_uri=None,
+                 shape_geometry="points", shape_precision=None, sort_output=False, sort_memory=1 << 28,
+                 pipeline=False, agencies=None, routes=None, start_date=None, end_date=None, checkpoint=None,
+                 checkpoint_interval=100000):
+        if engine not in self.ENGINES:
+            raise ValueError("engine must be one of %s, not %s" % (self.ENGINES, engine))
+        if engine == "columnar" and not stream:
+            raise ValueError("the columnar engine writes N-Triples lines directly and needs stream=True")
+        if engine == "columnar" and pyarrow is None:
+            raise ImportError("the columnar engine needs pyarrow")
+        if store is not None and (stream or store_path is None):
+            raise ValueError("a persistent store needs a store_path and cannot be used with stream=True")
+        if sort_output and not stream:
+            raise ValueError("only streamed output needs sorting, a graph has no duplicates to begin with")
+        if checkpoint is not None and (not stream or sort_output or compression is not None or part_bytes is not None
+                                       or part_triples is not None):
+            raise ValueError("checkpoints need streamed output that is neither sorted, compressed nor split into "
+                             "parts, so that it can be cut back to where the checkpoint was taken")
+        if shape_geometry not in self.SHAPE_GEOMETRIES:
+            raise ValueError("shape_geometry must be one of %s, not %s" % (self.SHAPE_GEOMETRIES, shape_geometry))
+        if (part_bytes is not None or part_triples is not None) and serialize not in self.STREAM_FORMATS:
+            raise ValueError("output can only be split into parts with one of %s, not %s"
+                             % (self.STREAM_FORMATS, serialize))
         self.output_file = output_file
-        self.graph = Graph(identifier=uri)
+        self.graph_uri = uri if graph_uri is None else graph_uri
+        self.shape_geometry = shape_geometry
+        self.shape_precision = shape_precision
+        self.compression = compression
+        self.compression_level = compression_level
+        self.part_bytes = part_bytes
+        self.part_triples = part_triples
+        self.sort_output = sort_output
+        self.sort_memory = sort_memory
+        self.sorted = None
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.resumed = None
+        # the options that change what is written, as they are kept in the checkpoint
+        self.checkpoint_options = json.loads(json.dumps(
+            {"uri": uri, "graph_uri": self.graph_uri, "serialize": serialize, "engine": engine, "workers": workers,
+             "entity_cache_size": entity_cache_size, "shape_geometry": shape_geometry,
+             "shape_precision": shape_precision, "agencies": sorted(set(agencies)) if agencies else None,
+             "routes": sorted(set(routes)) if routes else None, "start_date": start_date, "end_date": end_date},
+            default=str))
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint) as state_file:
+                self.resumed = json.load(state_file)
+            if self.resumed["output_file"] != os.path.abspath(output_file):
+                raise ValueError("checkpoint %s was taken while writing %s, not %s"
+                                 % (checkpoint, self.resumed["output_file"], output_file))
+            changed = sorted(name for name, value in self.checkpoint_options.items()
+                             if self.resumed["options"].get(name) != value)
+            if changed:
+                raise ValueError("checkpoint %s was taken with a different %s, resuming would mix output of both"
+                                 % (checkpoint, ", ".join(changed)))
+        self.pipeline = pipeline
+        self.reading = None
+        self.read_stats = {"busy": 0.0, "blocked": 0.0, "batches": 0, "max_depth": 0, "waiting": 0.0}
+        self.stream = stream
+        self.engine = engine
+        if stream:
+            if serialize not in self.STREAM_FORMATS:
+                raise ValueError("streaming output needs one of %s, not %s" % (self.STREAM_FORMATS, serialize))
+            if sort_output:
+                # triples are streamed to a scratch file, and only the sorted lines go to the output file
+                self.sort_dir = mkdtemp(prefix="gtfs_unsorted_", dir=os.path.dirname(os.path.abspath(output_file)))
+                destination = os.path.join(self.sort_dir, "unsorted." + serialize)
+            elif self.resumed is not None:
+                # whatever was written after the checkpoint is thrown away and written again
+                destination = open(output_file, "r+b")
+                destination.truncate(self.resumed["output_bytes"])
+                destination.seek(self.resumed["output_bytes"])
+            else:
+                destination = self.open_output()
+            context = self.graph_uri if serialize == "nquads" else None
+            if pipeline:
+                self.graph = PipelinedTripleStream(destination, context, self.PIPELINE_QUEUE_SIZE)
+            else:
+                self.graph = TripleStream(destination, context)
+        elif store is not None:
+            self.graph = BatchedGraph(store, self.graph_uri, batch_size)
+            self.graph.open(store_path, create=True)
+        else:
+            self.graph = Graph(identifier=self.graph_uri)
         self.graph.bind("gtfs", self.GTFS)
         self.graph.bind("geo", self.GEO)
         self.graph.bind("schema", self.SCHEMA)
+        self.graph.bind("geosparql", self.GEOSPARQL)
         self.uri = uri
         self.serialize = serialize
         self.next_fare_rule_num = 0
+        self.entity_cache_size = entity_cache_size
+        self.entities = LruCache(entity_cache_size)
+        self.literal_cache_size = literal_cache_size
+        self.literals = LruCache(literal_cache_size)
+        self.workers = workers
+        self.byte_range = None
+        self.row_filters = {}
+        self.agencies = set(agencies) if agencies else None
+        self.routes = set(routes) if routes else None
+        self.start_date = self.__parse_date(start_date)
+        self.end_date = self.__parse_date(end_date)
+        self.id_filters = {}
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.profile_dir = profile_dir
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+        self.trace_memory = trace_memory
+        self.rows_read = 0
+        self.stage = None
+        self.stages = []
+        self.zip = None
+        self.source = None
+        self.completed = []
+        self.resume_rows = 0
+        self.checkpointed_rows = 0
+        if self.resumed is not None:
+            self.__restore(self.resumed)
         if zip_file is not None:
             self.open_zip(zip_file)
 
     def open_zip(self, filename):
-        dir_name = "gtfs_extract"
-        # ZipFile.extractall(filename, path=dir_name)
-        zip = ZipFile(filename)
-        zip.extractall(dir_name)
-        self.convert_directory(dir_name)
-        # shutil.rmtree(dir_name)
+        self.convert_source(filename)
+        self.output()
 
     def convert_directory(self, dir_name):
         if os.path.isdir(dir_name):
-            cwd = os.getcwd()
-            os.chdir(dir_name)
-            if os.path.isfile("agency.txt"):
-                self.convert_agency("agency.txt")
-            if os.path.isfile("stops.txt"):
-                self.convert_stops("stops.txt")
-            if os.path.isfile("routes.txt"):
-                self.convert_routes("routes.txt")
-            if os.path.isfile("trips.txt"):
-                self.convert_trips("trips.txt")
-            if os.path.isfile("stop_times.txt"):
-                self.convert_stop_times("stop_times.txt")
-            if os.path.isfile("calendar.txt"):
-                self.convert_calendar("calendar.txt")
-            if os.path.isfile("calendar_dates.txt"):
-                self.convert_calendar_dates("calendar_dates.txt")
-            if os.path.isfile("fare_attributes.txt"):
-                self.convert_fare_attributes("fare_attributes.txt")
-            if os.path.isfile("fare_rules.txt"):
-                self.convert_fare_rules("fare_rules.txt")
-            if os.path.isfile("shapes.txt"):
-                self.convert_shapes("shapes.txt")
-            if os.path.isfile("frequencies.txt"):
-                self.convert_frequencies("frequencies.txt")
-            if os.path.isfile("transfers.txt"):
-                self.convert_transfers("transfers.txt")
-            if os.path.isfile("feed_info.txt"):
-                self.convert_feed("feed_info.txt")
-            os.chdir(cwd)
+            self.convert_source(dir_name)
             self.output()
 
+    def convert_source(self, source, filenames=None):
+        """Converts the GTFS files (or only those in filenames) of a zip file or directory, without writing output."""
+        if self.resumed is not None and self.resumed["source"] != os.path.abspath(source):
+            raise ValueError("checkpoint %s was taken while converting %s, not %s"
+                             % (self.checkpoint, self.resumed["source"], source))
+        self.source = os.path.abspath(source)
+        if self.has_filters() and not self.id_filters:
+            self.resolve_filters(source)
+        for filename, method, path in self.__source_files(source):
+            if (filenames is None or filename in filenames) and filename not in self.completed:
+                current = self.resumed["current"] if self.resumed is not None else None
+                if current is None or current["file"] != filename:
+                    current = {"rows": 0, "triples": 0}
+                self.resume_rows = self.checkpointed_rows = current["rows"]
+                self.__run_stage(filename, method, path, current["rows"], current["triples"])
+                self.completed.append(filename)
+                self.save_checkpoint()
+
+    def checkpoint_rows(self, rows):
+        """Called between rows once the first rows rows of the file being converted are, takes a checkpoint every
+        checkpoint_interval rows."""
+        if self.checkpoint is None or self.stage is None or rows - self.checkpointed_rows < self.checkpoint_interval:
+            return
+        if self.stage["method"] == "convert_shapes" and self.shape_geometry == "wkt":
+            # nothing is written until the whole file has been read
+            return
+        self.save_checkpoint(rows)
+
+    def save_checkpoint(self, rows=None):
+        """Flushes the output and records how far the conversion got, for a later run to resume from.
+
+        rows is how many rows of the file being converted are done, or None between files.
+        """
+        if self.checkpoint is None:
+            return
+        state = {"source": self.source, "options": self.checkpoint_options,
+                 "output_file": os.path.abspath(self.output_file), "output_bytes": self.graph.flush(),
+                 "triples": self.graph.triples, "completed": self.completed,
+                 "current": None if rows is None else {"file": self.stage["file"], "rows": rows,
+                                                       "triples": self.graph.triples - self.stage["start_triples"]},
+                 "next_fare_rule_num": self.next_fare_rule_num, "stages": self.stages,
+                 # in least recently used order, so that a bounded cache evicts just as it would have
+                 "entities": list(self.entities.entries)}
+        with open(self.checkpoint + ".tmp", "w") as state_file:
+            json.dump(state, state_file)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(self.checkpoint + ".tmp", self.checkpoint)
+        self.checkpointed_rows = rows or 0
+        logger.debug("checkpoint at %s", state["current"] or "%d files" % len(self.completed))
+
+    def __restore(self, state):
+        self.completed = state["completed"]
+        self.graph.triples = state["triples"]
+        self.next_fare_rule_num = state["next_fare_rule_num"]
+        self.stages = state["stages"]
+        for key in state["entities"]:
+            self.entities.put(key, Resource(self.graph, URIRef(self.uri + key)))
+        logger.info("resuming from %s after %s", self.checkpoint,
+                    state["current"] or "%d completed files" % len(self.completed))
+
+    def __run_stage(self, filename, method, path, resumed_rows=0, resumed_triples=0):
+        self.stage = {"file": filename, "method": method, "start_rows": self.rows_read - resumed_rows,
+                      "start_triples": self.triple_count() - resumed_triples, "start_time": time.perf_counter()}
+        rss_before = peak_rss()
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profile_dir is not None:
+            profiler = cProfile.Profile()
+            profiler.runcall(getattr(self, method), path)
+            profiler.dump_stats(os.path.join(self.profile_dir, method + ".prof"))
+        else:
+            getattr(self, method)(path)
+        stage = self.stage_progress()
+        stage["peak_rss"] = peak_rss()
+        stage["peak_rss_delta"] = stage["peak_rss"] - rss_before if rss_before is not None else None
+        if self.trace_memory:
+            stage["traced_memory"], stage["traced_memory_peak"] = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        self.stages.append(stage)
+        self.stage = None
+        logger.info("%s: %d rows, %d triples in %.2fs (%.0f rows/s)", filename, stage["rows"], stage["triples"],
+                    stage["seconds"], stage["rows_per_sec"])
+
+    def stage_progress(self):
+        """Returns rows read, triples added, time taken and throughput so far for the file being converted."""
+        seconds = time.perf_counter() - self.stage["start_time"]
+        rows = self.rows_read - self.stage["start_rows"]
+        triples = self.triple_count() - self.stage["start_triples"]
+        progress = {"file": self.stage["file"], "method": self.stage["method"], "rows": rows, "triples": triples,
+                    "seconds": seconds, "rows_per_sec": rows / seconds if seconds else 0.0,
+                    "triples_per_sec": triples / seconds if seconds else 0.0}
+        if self.pipeline:
+            progress["queue_depths"] = {
+                "rows": self.reading.qsize() if self.reading is not None else 0,
+                "triples": self.graph.queue.qsize() if isinstance(self.graph, PipelinedTripleStream) else 0}
+        return progress
+
+    def add_rows(self, count):
+        self.rows_read += count
+        if self.stage is None:
+            return
+        # progress is reported each time the rows of the current file pass a multiple of progress_interval
+        rows = self.rows_read - self.stage["start_rows"]
+        if rows // self.progress_interval > (rows - count) // self.progress_interval:
+            progress = self.stage_progress()
+            logger.info("%s: %d rows, %d triples after %.0fs (%.0f rows/s)", progress["file"], progress["rows"],
+                        progress["triples"], progress["seconds"], progress["rows_per_sec"])
+            if self.progress is not None:
+                self.progress(progress)
+
+    def triple_count(self):
+        return self.graph.triples if self.stream else len(self.graph)
+
+    def fingerprint_source(self, source):
+        """Returns a set of row fingerprints for each GTFS file in a zip file or directory."""
+        if self.has_filters() and not self.id_filters:
+            self.resolve_filters(source)
+        return {filename: set(self.fingerprint(row) for row in self.__open_file(path))
+                for filename, method, path in self.__source_files(source)}
+
+    @staticmethod
+    def fingerprint(row):
+        # columns are sorted so that reordering them between feed versions does not count as a change
+        values = "\x1f".join("%s=%s" % item for item in sorted(row.items(), key=lambda item: str(item[0])))
+        return int.from_bytes(blake2b(values.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def has_filters(self):
+        return any(value is not None for value in (self.agencies, self.routes, self.start_date, self.end_date))
+
+    def resolve_filters(self, source):
+        """Works out which trips, routes, services and shapes the agency, route and date filters keep.
+
+        A trip is kept when its route is one of the routes (and belongs to one of the agencies) asked for and its
+        service runs on at least one day from start_date to end_date. Only the routes, services and shapes of kept
+        trips are then converted, and only the stop times and frequencies of kept trips. Stops, transfers and fares
+        are not filtered.
+        """
+        agency_ids, route_agencies, trips, calendar, calendar_dates = [], {}, [], [], []
+        for filename, method, path in self.__source_files(source):
+            if filename == "agency.txt":
+                agency_ids = [str.strip(row.get("agency_id") or "") for row in self.__read_table(path)]
+            elif filename == "routes.txt":
+                route_agencies = {str.strip(row["route_id"]): str.strip(row.get("agency_id") or "")
+                                  for row in self.__read_table(path)}
+            elif filename == "trips.txt":
+                trips = [(str.strip(row["trip_id"]), str.strip(row["route_id"]), str.strip(row["service_id"]),
+                          str.strip(row.get("shape_id") or "")) for row in self.__read_table(path)]
+            elif filename == "calendar.txt":
+                calendar = list(self.__read_table(path))
+            elif filename == "calendar_dates.txt":
+                calendar_dates = list(self.__read_table(path))
+        routes = set(route_agencies)
+        if self.routes is not None:
+            routes &= self.routes
+        if self.agencies is not None:
+            # a route without an agency_id belongs to the feed's only agency
+            only_agency = agency_ids[0] if len(agency_ids) == 1 else None
+            routes = set(route_id for route_id in routes
+                         if (route_agencies[route_id] or only_agency) in self.agencies)
+        services = None
+        if self.start_date is not None or self.end_date is not None:
+            services = self.__active_services(calendar, calendar_dates)
+        kept = [trip for trip in trips if trip[1] in routes and (services is None or trip[2] in services)]
+        trip_ids = frozenset(trip[0] for trip in kept)
+        route_ids = frozenset(trip[1] for trip in kept)
+        service_ids = frozenset(trip[2] for trip in kept)
+        shape_ids = frozenset(trip[3] for trip in kept if trip[3])
+        self.id_filters = {"routes.txt": ("route_id", route_ids), "trips.txt": ("trip_id", trip_ids),
+                           "stop_times.txt": ("trip_id", trip_ids), "frequencies.txt": ("trip_id", trip_ids),
+                           "calendar.txt": ("service_id", service_ids),
+                           "calendar_dates.txt": ("service_id", service_ids),
+                           "shapes.txt": ("shape_id", shape_ids),
+                           # fare rules that do not name a route apply whatever the route
+                           "fare_rules.txt": ("route_id", route_ids | frozenset([""]))}
+        if self.agencies is not None:
+            self.id_filters["agency.txt"] = ("agency_id", frozenset(self.agencies))
+        logger.info("filters keep %d of %d trips, %d routes, %d services and %d shapes", len(trip_ids), len(trips),
+                    len(route_ids), len(service_ids), len(shape_ids))
+
+    def __id_filter(self, filename):
+        if self.has_filters() and not self.id_filters and self.zip is None:
+            # a convert_* method called on its own, the rest of the feed is next to its file
+            self.resolve_filters(os.path.dirname(os.path.abspath(filename)))
+        return self.id_filters.get(os.path.basename(filename))
+
+    def __active_services(self, calendar, calendar_dates):
+        # a service is active on a day its calendar covers, unless removed that day, or on a day it is added
+        start = self.start_date or date.min
+        end = self.end_date or date.max
+        removed = set()
+        active = set()
+        for row in calendar_dates:
+            day = self.__parse_date(str.strip(row["date"]))
+            service_id = str.strip(row["service_id"])
+            if str.strip(row["exception_type"]) == "2":
+                removed.add((service_id, day))
+            elif start <= day <= end:
+                active.add(service_id)
+        weekdays = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+        for row in calendar:
+            service_id = str.strip(row["service_id"])
+            runs = [str.strip(row[weekday]) == "1" for weekday in weekdays]
+            day = max(start, self.__parse_date(str.strip(row["start_date"])))
+            last = min(end, self.__parse_date(str.strip(row["end_date"])))
+            while service_id not in active and day <= last:
+                if runs[day.weekday()] and (service_id, day) not in removed:
+                    active.add(service_id)
+                day += timedelta(days=1)
+        return active
+
+    @staticmethod
+    def __parse_date(value):
+        if value is None or isinstance(value, date):
+            return value
+        return datetime.strptime(value, "%Y%m%d").date()
+
+    def __read_table(self, filename):
+        fieldnames, csv_file = self.__open_stream(filename)
+        with csv_file:
+            yield from DictReader(TextIOWrapper(csv_file, encoding="utf-8"), fieldnames=fieldnames,
+                                  skipinitialspace=True)
+
+    def __source_files(self, source):
+        if os.path.isdir(source):
+            present = os.listdir(source)
+            for filename, method in self.GTFS_FILES:
+                if filename in present:
+                    yield filename, method, os.path.join(source, filename)
+        else:
+            with ZipFile(source) as zip_file:
+                self.zip = zip_file
+                try:
+                    present = zip_file.namelist()
+                    for filename, method in self.GTFS_FILES:
+                        if filename in present:
+                            yield filename, method, filename
+                finally:
+                    self.zip = None
+
+    def __open_binary(self, filename):
+        if self.zip is not None:
+            return self.zip.open(filename)
+        return open(filename, "rb")
+
+    def __open_stream(self, filename):
+        csv_file = self.__open_binary(filename)
+        # the header is decoded with utf-8-sig so that a byte order mark does not end up in the first field name
+        fieldnames = next(reader([csv_file.readline().decode("utf-8-sig")], skipinitialspace=True))
+        logger.debug("%s: %s", filename, fieldnames)
+        if self.byte_range is not None:
+            csv_file = BufferedReader(ByteRange(csv_file, *self.byte_range))
+        return fieldnames, csv_file
+
     def __open_file(self, filename):
-        file_read = DictReader(open(filename), skipinitialspace=True)
-        if file_read.fieldnames[0].find("ï»¿") >= 0:
-            file_read.fieldnames[0] = file_read.fieldnames[0][3:]
-        print(file_read.fieldnames)
-        return file_read
+        fieldnames, csv_file = self.__open_stream(filename)
+        id_filter = self.__id_filter(filename)
+        keep = self.row_filters.get(os.path.basename(filename))
+        if id_filter is not None and id_filter[0] in fieldnames:
+            return self.__open_filtered(fieldnames, csv_file, id_filter, keep)
+        file_read = DictReader(TextIOWrapper(csv_file, encoding="utf-8"), fieldnames=fieldnames,
+                               skipinitialspace=True)
+        if self.pipeline:
+            file_read = self.__read_ahead(file_read)
+        return self.__count_rows(file_read, keep)
+
+    def __open_filtered(self, fieldnames, csv_file, id_filter, keep):
+        # rows are checked against the ids while still lists, so the ones left out never become dicts
+        column, ids = id_filter
+        index = fieldnames.index(column)
+        # blank lines are left out, as DictReader and pyarrow do, so that rows are numbered the same way
+        file_read = (row for row in reader(TextIOWrapper(csv_file, encoding="utf-8"), skipinitialspace=True) if row)
+        if self.pipeline:
+            file_read = self.__read_ahead(file_read)
+        for row in self.__count_rows(file_read, lambda row: len(row) > index and str.strip(row[index]) in ids):
+            row = dict(zip(fieldnames, row))
+            if keep is None or keep(row):
+                yield row
+
+    def __read_ahead(self, rows):
+        # the reader stage: rows are read, decompressed and parsed on their own thread and handed over in batches
+        batches = PipelineQueue(self.PIPELINE_QUEUE_SIZE)
+        stop = Event()
+
+        def read():
+            start = time.perf_counter()
+            try:
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) == self.READ_BATCH_SIZE:
+                        batches.put(batch)
+                        batch = []
+                        if stop.is_set():
+                            return
+                batches.put(batch)
+                batches.put(None)
+            except Exception as error:
+                batches.put(error)
+            finally:
+                self.read_stats["busy"] += time.perf_counter() - start - batches.put_wait
+
+        thread = Thread(target=read, name="gtfs-row-reader", daemon=True)
+        self.reading = batches
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield from batch
+        finally:
+            # the converter may stop early, in which case the reader is unblocked and left to finish
+            stop.set()
+            while thread.is_alive():
+                try:
+                    batches.get(timeout=0.01)
+                except Empty:
+                    pass
+            self.reading = None
+            self.read_stats["blocked"] += batches.put_wait
+            self.read_stats["waiting"] += batches.get_wait
+            self.read_stats["batches"] += batches.batches
+            self.read_stats["max_depth"] = max(self.read_stats["max_depth"], batches.max_depth)
+
+    def __count_rows(self, rows, keep):
+        # rows converted before the checkpoint being resumed from, or by the columnar engine, are only read past
+        skip, self.resume_rows = self.resume_rows, 0
+        for num, row in enumerate(rows):
+            if num < skip:
+                continue
+            self.checkpoint_rows(num)
+            self.add_rows(1)
+            if keep is None or keep(row):
+                yield row
+
+    def __use_columnar(self, filename):
+        return self.engine == "columnar" and os.path.basename(filename) not in self.row_filters
+
+    def __chunk_boundaries(self, filename, chunks):
+        # splits the rows after the header into byte ranges that each start at the beginning of a line
+        with open(filename, "rb") as csv_file:
+            csv_file.readline()
+            start = csv_file.tell()
+            end = csv_file.seek(0, 2)
+            boundaries = [start]
+            for chunk in range(1, chunks):
+                offset = start + (end - start) * chunk // chunks
+                if offset <= boundaries[-1]:
+                    continue
+                csv_file.seek(offset - 1)
+                csv_file.readline()
+                boundaries.append(min(csv_file.tell(), end))
+            boundaries.append(end)
+        return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)
+                if boundaries[i] < boundaries[i + 1]]
+
+    def __convert_parallel(self, method, csv_filename):
+        # each chunk is converted in a worker process to its own N-Triples shard, shards are then merged in order
+        shard_format = "nquads" if self.serialize == "nquads" else "nt"
+        options = {"uri": self.uri, "graph_uri": self.graph_uri, "serialize": shard_format, "stream": True,
+                   "entity_cache_size": self.entity_cache_size, "engine": self.engine,
+                   "literal_cache_size": self.literal_cache_size}
+        known = list(self.entities.entries)
+        # resolves the filters before they are handed to the workers
+        self.__id_filter(csv_filename)
+        shard_dir = mkdtemp(prefix="gtfs_shards_", dir=os.path.dirname(os.path.abspath(self.output_file)))
+        try:
+            if self.zip is not None:
+                # seeking in a zip member decompresses it from its start, so rather than every worker decompressing
+                # everything before its chunk the member is decompressed once, next to the shards
+                extracted = os.path.join(shard_dir, os.path.basename(csv_filename))
+                with self.zip.open(csv_filename) as member, open(extracted, "wb") as extracted_file:
+                    shutil.copyfileobj(member, extracted_file, 1 << 20)
+                csv_filename = extracted
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = []
+                for num, byte_range in enumerate(self.__chunk_boundaries(csv_filename, self.workers)):
+                    shard = os.path.join(shard_dir, "%s_%d.%s" % (method, num, shard_format))
+                    futures.append((shard, pool.submit(_convert_chunk, options, known, self.id_filters, csv_filename,
+                                                       method, byte_range, shard)))
+                for shard, future in futures:
+                    rows, triples, new_entities = future.result()
+                    if self.stream:
+                        # an entity first seen in more than one chunk is described by each of them, keep the first
+                        described = [URIRef(self.uri + key).n3() for key in new_entities
+                                     if key in self.entities.entries]
+                        self.graph.append(shard, triples, frozenset((uri, predicate.n3()) for uri in described
+                                                                    for predicate in (RDF.type, DCTERMS.identifier)))
+                    else:
+                        self.graph.parse(shard, format=shard_format)
+                    for key in new_entities:
+                        self.entities.put(key, Resource(self.graph, URIRef(self.uri + key)))
+                    self.add_rows(rows)
+        finally:
+            shutil.rmtree(shard_dir)
 
     def convert_agency(self, csv_filename):
         read_agency = self.__open_file(csv_filename)
@@ -111,7 +1432,7 @@ class GtfsCsvToRdf:
                 stop.add(self.GTFS.zone, self.get_zone(row['zone_id']))
             if 'stop_url' in row and str.strip(row["stop_url"]) != "":
                 stop.add(FOAF.page, Literal(row['stop_url'], datatype=XSD.string))
-            if 'location_type' in row and row['location_type'] is "1":
+            if 'location_type' in row and str.strip(row['location_type']) == "1":
                 stop.set(RDF.type, self.GTFS.Station)
             else:
                 stop.set(RDF.type, self.GTFS.Stop)
@@ -120,7 +1441,7 @@ class GtfsCsvToRdf:
             if 'stop_timezone' in row and str.strip(row["stop_timezone"]) != "":
                 stop.add(self.GTFS.timeZone, Literal(row['stop_timezone'], datatype=XSD.string))
             if 'wheelchair_boarding' in row and str.strip(row["wheelchair_boarding"]) != "":
-                accessibility = self.get_wheelchair_accessible(row['wheelchair_boarding'])
+                accessibility = self.get_wheelchair_accessible(str.strip(row['wheelchair_boarding']))
                 stop.add(self.GTFS.wheelchairAccesssible, accessibility)
 
     def convert_routes(self, csv_filename):
@@ -155,19 +1476,27 @@ class GtfsCsvToRdf:
             if "trip_short_name" in row and str.strip(row["trip_short_name"]) != "":
                 trip.add(self.GTFS.shortName, Literal(str.strip(row["trip_short_name"]), datatype=XSD.string))
             if "direction_id" in row and str.strip(row["direction_id"]) != "":
-                trip.add(self.GTFS.direction, Literal(str.strip(row["direction_id"]), datatype=XSD.boolean))
+                trip.add(self.GTFS.direction, self.get_literal(str.strip(row["direction_id"]), XSD.boolean))
             if "block_id" in row and str.strip(row["block_id"]) != "":
                 trip.add(self.GTFS.block, Literal(str.strip(row["block_id"]), datatype=XSD.nonNegativeInteger))
             if "shape_id" in row and str.strip(row["shape_id"]) != "":
                 trip.add(self.GTFS.shape, self.get_shape(str.strip(row["shape_id"])))
             if "wheelchair_accessible" in row and str.strip(row["wheelchair_accessible"]) != "":
-                accessibility = self.get_wheelchair_accessible(row['wheelchair_accessible'])
+                accessibility = self.get_wheelchair_accessible(str.strip(row['wheelchair_accessible']))
                 trip.add(self.GTFS.wheelchairAccessible, accessibility)
             if "bikes_allowed" in row and str.strip(row["bikes_allowed"]) != "":
                 bikes = self.get_bikes_allowed(str.strip(row["bikes_allowed"]))
                 trip.add(self.GTFS.bikesAllowed, bikes)
 
     def convert_stop_times(self, csv_filename):
+        if self.workers > 1 and self.byte_range is None:
+            return self.__convert_parallel("convert_stop_times", csv_filename)
+        if self.__use_columnar(csv_filename):
+            engine = ColumnarEngine(self, self.__id_filter(csv_filename))
+            engine.convert_stop_times(*self.__open_stream(csv_filename))
+            if engine.fallback_rows is None:
+                return
+            self.resume_rows = engine.fallback_rows
         read_stop_times = self.__open_file(csv_filename)
         for row in read_stop_times:
             stop_id = str.strip(row["stop_id"])
@@ -176,10 +1505,10 @@ class GtfsCsvToRdf:
             stop_time = Resource(self.graph, URIRef(self.uri + trip_id + "_" + stop_id + "_StopTime_" + sequence_num))
             stop_time.set(RDF.type, self.GTFS.StopTime)
             stop_time.add(self.GTFS.trip, self.get_trip(trip_id))
-            stop_time.add(self.GTFS.arrivalTime, Literal(str.strip(row["arrival_time"]), datatype=XSD.time))
-            stop_time.add(self.GTFS.departureTime, Literal(str.strip(row["departure_time"]), datatype=XSD.time))
+            stop_time.add(self.GTFS.arrivalTime, self.get_literal(str.strip(row["arrival_time"]), XSD.time))
+            stop_time.add(self.GTFS.departureTime, self.get_literal(str.strip(row["departure_time"]), XSD.time))
             stop_time.add(self.GTFS.stop, self.get_stop(stop_id))
-            stop_time.add(self.GTFS.stopSequence, Literal(sequence_num, datatype=XSD.nonNegativeInteger))
+            stop_time.add(self.GTFS.stopSequence, self.get_literal(sequence_num, XSD.nonNegativeInteger))
             if "stop_headsign" in row:
                 stop_time.add(self.GTFS.headsign, Literal(str.strip(row["stop_headsign"]), datatype=XSD.string))
             if "pickup_type" in row:
@@ -188,10 +1517,11 @@ class GtfsCsvToRdf:
             if "drop_off_type" in row:
                 dropoff_type = self.get_stop_type(str.strip(row["drop_off_type"]))
                 stop_time.add(self.GTFS.dropOffType, dropoff_type)
-            if "shape_dist_traveled" in row:
+            if "shape_dist_traveled" in row and str.strip(row["shape_dist_traveled"]) != "":
                 # stop_time.add(self.GTFS.distanceTraveled,
                 # Literal(float(str.strip(row["shape_dist_traveled"])), datatype=XSD.nonNegativeInteger))
-                stop_time.add(self.GTFS.distanceTraveled, Literal(float(str.strip(row["shape_dist_traveled"]))))
+                distance = self.get_distance_literal(str.strip(row["shape_dist_traveled"]))
+                stop_time.add(self.GTFS.distanceTraveled, distance)
             # if "timepoint" in row:
                 # do something... this predicate is not implemented yet
 
@@ -202,17 +1532,17 @@ class GtfsCsvToRdf:
             calendar = Resource(self.graph, URIRef(self.uri + str.strip(row["service_id"]) + "_cal"))
             service.add(self.GTFS.serviceRule, calendar)
             calendar.set(RDF.type, self.GTFS.CalendarRule)
-            calendar.set(self.GTFS.monday, Literal(str.strip(row["monday"]), datatype=XSD.boolean))
-            calendar.set(self.GTFS.tuesday, Literal(str.strip(row["tuesday"]), datatype=XSD.boolean))
-            calendar.set(self.GTFS.wednesday, Literal(str.strip(row["wednesday"]), datatype=XSD.boolean))
-            calendar.set(self.GTFS.thursday, Literal(str.strip(row["thursday"]), datatype=XSD.boolean))
-            calendar.set(self.GTFS.friday, Literal(str.strip(row["friday"]), datatype=XSD.boolean))
-            calendar.set(self.GTFS.saturday, Literal(str.strip(row["saturday"]), datatype=XSD.boolean))
-            calendar.set(self.GTFS.sunday, Literal(str.strip(row["sunday"]), datatype=XSD.boolean))
+            calendar.set(self.GTFS.monday, self.get_literal(str.strip(row["monday"]), XSD.boolean))
+            calendar.set(self.GTFS.tuesday, self.get_literal(str.strip(row["tuesday"]), XSD.boolean))
+            calendar.set(self.GTFS.wednesday, self.get_literal(str.strip(row["wednesday"]), XSD.boolean))
+            calendar.set(self.GTFS.thursday, self.get_literal(str.strip(row["thursday"]), XSD.boolean))
+            calendar.set(self.GTFS.friday, self.get_literal(str.strip(row["friday"]), XSD.boolean))
+            calendar.set(self.GTFS.saturday, self.get_literal(str.strip(row["saturday"]), XSD.boolean))
+            calendar.set(self.GTFS.sunday, self.get_literal(str.strip(row["sunday"]), XSD.boolean))
             temporal = Resource(self.graph, URIRef(self.uri + str.strip(row["service_id"]) + "_cal" + "_temporal"))
             calendar.set(DCTERMS.temporal, temporal)
-            temporal.add(self.SCHEMA.startDate, self.get_date_literal(str.strip(row["start_date"])))
-            temporal.add(self.SCHEMA.endDate, self.get_date_literal(str.strip(row["end_date"])))
+            temporal.add(self.SCHEMA.startDate, self.__date_literal(str.strip(row["start_date"])))
+            temporal.add(self.SCHEMA.endDate, self.__date_literal(str.strip(row["end_date"])))
 
     def convert_calendar_dates(self, csv_filename):
         read_dates = self.__open_file(csv_filename)
@@ -221,11 +1551,11 @@ class GtfsCsvToRdf:
             calendar_date = Resource(self.graph, URIRef(self.uri + str.strip(row["service_id"]) + "_cal" + "_" + str.strip(row["date"])))
             service.add(self.GTFS.serviceRule, calendar_date)
             calendar_date.set(RDF.type, self.GTFS.CalendarDateRule)
-            calendar_date.add(DCTERMS.date, self.get_date_literal(str.strip(row["date"])))
+            calendar_date.add(DCTERMS.date, self.__date_literal(str.strip(row["date"])))
             exception_type = str.strip(row["exception_type"])
-            if exception_type is "2":
+            if exception_type == "2":
                 exception_type = "0"
-            calendar_date.add(self.GTFS.dateAddition, Literal(exception_type, datatype=XSD.boolean))
+            calendar_date.add(self.GTFS.dateAddition, self.get_literal(exception_type, XSD.boolean))
 
     def convert_fare_attributes(self, csv_filename):
         read_fares = self.__open_file(csv_filename)
@@ -257,6 +1587,17 @@ class GtfsCsvToRdf:
                 fare_rule.add(self.GTFS.zone, self.get_zone(str.strip(row["contains_id"])))
 
     def convert_shapes(self, csv_filename):
+        if self.shape_geometry == "wkt":
+            # a shape's points can be anywhere in the file, so this always reads it whole in this process
+            return self.convert_shape_lines(csv_filename)
+        if self.workers > 1 and self.byte_range is None:
+            return self.__convert_parallel("convert_shapes", csv_filename)
+        if self.__use_columnar(csv_filename):
+            engine = ColumnarEngine(self, self.__id_filter(csv_filename))
+            engine.convert_shapes(*self.__open_stream(csv_filename))
+            if engine.fallback_rows is None:
+                return
+            self.resume_rows = engine.fallback_rows
         read_shapes = self.__open_file(csv_filename)
         for row in read_shapes:
             shape = self.get_shape(str.strip(row["shape_id"]))
@@ -265,10 +1606,37 @@ class GtfsCsvToRdf:
             shape_point.set(RDF.type, self.GTFS.ShapePoint)
             shape_point.set(self.GEO.long, Literal(str.strip(row["shape_pt_lon"]), datatype=XSD.string))
             shape_point.set(self.GEO.lat, Literal(str.strip(row["shape_pt_lat"]), datatype=XSD.string))
-            shape_point.set(self.GTFS.pointSequence, Literal(str.strip(row["shape_pt_sequence"]), datatype=XSD.nonNegativeInteger))
+            shape_point.set(self.GTFS.pointSequence, self.get_literal(str.strip(row["shape_pt_sequence"]), XSD.nonNegativeInteger))
             if "shape_dist_traveled" in row and str.strip(row["shape_dist_traveled"]) != "":
-                shape_point.set(self.GTFS.distanceTraveled, Literal(str.strip(row["shape_dist_traveled"]),
-                                                                    datatype=XSD.nonNegativeInteger))
+                shape_point.set(self.GTFS.distanceTraveled, self.get_literal(str.strip(row["shape_dist_traveled"]),
+                                                                             XSD.nonNegativeInteger))
+
+    def convert_shape_lines(self, csv_filename):
+        """Converts shapes.txt to one GeoSPARQL geometry per shape, its points in order as a WKT LineString.
+
+        Coordinates are rounded to shape_precision decimal places when that is set, and a point that is the same as
+        the one before it is left out. Distances travelled are not kept.
+        """
+        points = OrderedDict()
+        for row in self.__open_file(csv_filename):
+            lon, lat = str.strip(row["shape_pt_lon"]), str.strip(row["shape_pt_lat"])
+            if self.shape_precision is not None:
+                lon, lat = "%.*f" % (self.shape_precision, float(lon)), "%.*f" % (self.shape_precision, float(lat))
+            points.setdefault(str.strip(row["shape_id"]), []).append(
+                (int(str.strip(row["shape_pt_sequence"])), lon + " " + lat))
+        for shape_id, shape_points in points.items():
+            shape_points.sort(key=lambda point: point[0])
+            coordinates = [coordinate for num, (sequence, coordinate) in enumerate(shape_points)
+                           if num == 0 or coordinate != shape_points[num - 1][1]]
+            if len(coordinates) == 1:
+                wkt = "POINT(%s)" % coordinates[0]
+            else:
+                wkt = "LINESTRING(%s)" % ", ".join(coordinates)
+            shape = self.get_shape(shape_id)
+            geometry = Resource(self.graph, URIRef(str(shape.identifier) + "_geometry"))
+            shape.add(self.GEOSPARQL.hasGeometry, geometry)
+            geometry.set(RDF.type, self.GEOSPARQL.Geometry)
+            geometry.set(self.GEOSPARQL.asWKT, Literal(wkt, datatype=self.GEOSPARQL.wktLiteral))
 
     def convert_frequencies(self, csv_filename):
         read_freqs = self.__open_file(csv_filename)
@@ -278,7 +1646,7 @@ class GtfsCsvToRdf:
             freq.add(self.GTFS.trip, self.get_trip(str.strip(row["trip_id"])))
             freq.add(self.GTFS.startTime, Literal(str.strip(row["start_time"]), datatype=XSD.string))
             freq.add(self.GTFS.endTime, Literal(str.strip(row["end_time"]), datatype=XSD.string))
-            freq.add(self.GTFS.headwaySeconds, Literal(str.strip(row["headway_secs"]), datatype=XSD.nonNegativeInteger))
+            freq.add(self.GTFS.headwaySeconds, self.get_literal(str.strip(row["headway_secs"]), XSD.nonNegativeInteger))
             if "exact_times" in row:
                 exact = False
                 if str.strip(row["exact_times"]) == "1":
@@ -296,7 +1664,7 @@ class GtfsCsvToRdf:
             transfers.add(self.GTFS.destinationStop, self.get_stop(to_stop))
             transfers.add(self.GTFS.transferType, self.get_transfer_type(str.strip(row["transfer_type"])))
             if "min_transfer_time" in row and str.strip(row["min_transfer_time"]):
-                transfers.add(self.GTFS.minimumTransferTime, Literal(str.strip(row["min_transfer_time"]), datatype=XSD.nonNegativeInteger))
+                transfers.add(self.GTFS.minimumTransferTime, self.get_literal(str.strip(row["min_transfer_time"]), XSD.nonNegativeInteger))
 
     def convert_feed(self, csv_filename):
         read_feed = self.__open_file(csv_filename)
@@ -311,120 +1679,472 @@ class GtfsCsvToRdf:
             if "feed_start_date" in row and str.strip(row["feed_start_date"]) != "" and "feed_end_date" in row and str.strip(row["feed_end_date"]) != "":
                 temporal = Resource(self.graph, URIRef(feed.identifier + "_temporal"))
                 temporal.set(RDF.type, DCTERMS.temporal)
-                temporal.add(self.SCHEMA.startDate, self.get_date_literal(str.strip(row["feed_start_date"])))
-                temporal.add(self.SCHEMA.endDate, self.get_date_literal(str.strip(row["feed_end_date"])))
+                temporal.add(self.SCHEMA.startDate, self.__date_literal(str.strip(row["feed_start_date"])))
+                temporal.add(self.SCHEMA.endDate, self.__date_literal(str.strip(row["feed_end_date"])))
 
     def output(self):
-        self.graph.serialize(destination=self.output_file, format=self.serialize)
+        if self.stream:
+            self.graph.close()
+            if self.sort_output:
+                self.__sort()
+            if self.checkpoint is not None and os.path.exists(self.checkpoint):
+                # the conversion is complete, so a run with the same arguments starts over
+                os.remove(self.checkpoint)
+            return
+        if isinstance(self.graph, BatchedGraph):
+            self.graph.flush()
+        if self.output_file is not None:
+            destination = self.open_output()
+            self.graph.serialize(destination=destination, format=self.serialize)
+            if destination is not self.output_file:
+                destination.close()
+        if isinstance(self.graph, BatchedGraph):
+            self.graph.close()
+
+    def __sort(self):
+        start = time.perf_counter()
+        sorter = LineSorter(self.sort_memory, self.sort_dir)
+        destination = self.open_output()
+        try:
+            if isinstance(destination, str):
+                with open(destination, "w", encoding="utf-8") as lines:
+                    sorter.sort(self.graph.file.name, lines)
+            else:
+                with TextIOWrapper(destination, encoding="utf-8") as lines:
+                    sorter.sort(self.graph.file.name, lines)
+        finally:
+            shutil.rmtree(self.sort_dir)
+        self.sorted = {"lines_read": sorter.lines_read, "lines_written": sorter.lines_written,
+                       "duplicates": sorter.lines_read - sorter.lines_written, "runs": sorter.runs,
+                       "seconds": time.perf_counter() - start}
+        logger.info("sorted %d lines into %d distinct ones in %.2fs", sorter.lines_read, sorter.lines_written,
+                    self.sorted["seconds"])
+
+    def open_output(self):
+        """Returns the output file name, or a file compressing and/or splitting the output when asked to."""
+        if self.compression is None and self.part_bytes is None and self.part_triples is None:
+            return self.output_file
+        return PartWriter.open(self.output_file, self.compression, self.part_bytes, self.part_triples,
+                               self.compression_level)
 
     def get_agency(self, agency_id):
-        agency = Resource(self.graph, URIRef(self.uri + "agency_" + agency_id))
-        agency.add(RDF.type, self.GTFS.Agency)
-        agency.set(DCTERMS.identifier, Literal(agency_id, datatype=XSD.string))
-        return agency
+        return self.__get_entity("agency_", agency_id)
 
     def get_stop(self, stop_id):
-        stop = Resource(self.graph, URIRef(self.uri + "stop_" + stop_id))
-        stop.set(DCTERMS.identifier, Literal(stop_id, datatype=XSD.string))
-        return stop
+        return self.__get_entity("stop_", stop_id)
 
     def get_zone(self, zone_id):
-        the_zone = Resource(self.graph, URIRef(self.uri + "zone_" + zone_id))
-        the_zone.set(RDF.type, self.GTFS.Zone)
-        the_zone.set(DCTERMS.identifier, Literal(zone_id, datatype=XSD.string))
-        return the_zone
+        return self.__get_entity("zone_", zone_id)
 
     def get_route(self, route_id):
-        route = Resource(self.graph, URIRef(self.uri + "route_" + route_id))
-        route.set(RDF.type, self.GTFS.Route)
-        route.set(DCTERMS.identifier, Literal(route_id, datatype=XSD.string))
-        return route
+        return self.__get_entity("route_", route_id)
 
     def get_trip(self, trip_id):
-        trip = Resource(self.graph, URIRef(self.uri + "trip_" + trip_id))
-        trip.set(RDF.type, self.GTFS.Trip)
-        trip.set(DCTERMS.identifier, Literal(trip_id, datatype=XSD.string))
-        return trip
+        return self.__get_entity("trip_", trip_id)
 
     def get_service(self, service_id):
-        service = Resource(self.graph, URIRef(self.uri + "service_" + service_id))
-        service.set(RDF.type, self.GTFS.Service)
-        service.set(DCTERMS.identifier, Literal(service_id, datatype=XSD.string))
-        return service
+        return self.__get_entity("service_", service_id)
 
     def get_shape(self, shape_id):
-        shape = Resource(self.graph, URIRef(self.uri + "shape_" + shape_id))
-        shape.set(RDF.type, self.GTFS.Shape)
-        shape.set(DCTERMS.identifier, Literal(shape_id, datatype=XSD.string))
-        return shape
+        return self.__get_entity("shape_", shape_id)
 
     def get_fare(self, fare_id):
-        fare = Resource(self.graph, URIRef(self.uri + "fare_" + fare_id))
-        fare.set(RDF.type, self.GTFS.FareClass)
-        fare.set(DCTERMS.identifier, Literal(fare_id, datatype=XSD.string))
-        return fare
+        return self.__get_entity("fare_", fare_id)
+
+    @classmethod
+    def entity_type(cls, key):
+        """Returns the type given to the interned entity with this key when it is first seen, if any."""
+        for prefix, rdf_type in cls.ENTITY_TYPES.items():
+            if key.startswith(prefix):
+                return rdf_type
+        return None
+
+    def __get_entity(self, prefix, entity_id):
+        # the type and identifier triples are only added the first time an entity is seen (or after it was evicted)
+        key = prefix + entity_id
+        entity = self.entities.get(key)
+        if entity is None:
+            entity = Resource(self.graph, URIRef(self.uri + key))
+            rdf_type = self.ENTITY_TYPES[prefix]
+            if rdf_type is not None:
+                entity.add(RDF.type, rdf_type)
+            entity.add(DCTERMS.identifier, Literal(entity_id, datatype=XSD.string))
+            self.entities.put(key, entity)
+        return entity
+
+    def stats(self):
+        stats = {"stages": self.stages,
+                 "total": {"rows": sum(stage["rows"] for stage in self.stages),
+                           "triples": sum(stage["triples"] for stage in self.stages),
+                           "seconds": sum(stage["seconds"] for stage in self.stages), "peak_rss": peak_rss()},
+                 "entity_cache": self.entities.stats(), "literal_cache": self.literals.stats()}
+        if isinstance(self.graph, BatchedGraph):
+            stats["store"] = {"batch_size": self.graph.batch_size, "commits": self.graph.commits}
+        if self.sorted is not None:
+            stats["sort"] = self.sorted
+        if self.pipeline:
+            stats["pipeline"] = self.pipeline_stats(stats["total"]["seconds"])
+        if self.id_filters:
+            stats["filters"] = {filename: {"column": column, "ids": len(ids)}
+                                for filename, (column, ids) in self.id_filters.items()}
+        return stats
+
+    def pipeline_stats(self, seconds):
+        """Returns how long each pipeline stage was busy and waiting, and how full the queues between them got.
+
+        A stage that is busy nearly all of the time while the others wait on it is the bottleneck.
+        """
+        writer = self.graph.stats() if isinstance(self.graph, PipelinedTripleStream) else None
+        # the converting thread waits for rows to read and for room in the writer's queue
+        waiting = self.read_stats["waiting"]
+        if writer is not None:
+            waiting += self.graph.queue.put_wait
+        return {"read": {"busy": self.read_stats["busy"], "waiting": self.read_stats["blocked"]},
+                "convert": {"busy": seconds - waiting, "waiting": waiting},
+                "write": {"busy": writer["busy"], "waiting": writer["waiting"]} if writer is not None else None,
+                "queues": {"rows": {"maxsize": self.PIPELINE_QUEUE_SIZE, "max_depth": self.read_stats["max_depth"],
+                                    "batches": self.read_stats["batches"]},
+                           "triples": writer["queue"] if writer is not None else None}}
 
     def get_wheelchair_accessible(self, wheelchair):
-        if wheelchair is "1":
-            accessibility = self.GTFS.WheelchairAccessible
-        elif wheelchair is "2":
-            accessibility = self.GTFS.NotWheelchairAccessible
-        else:
-            accessibility = self.GTFS.CheckParentStation
-        return accessibility
+        return self.WHEELCHAIR_ACCESSIBLE.get(wheelchair, self.WHEELCHAIR_ACCESSIBLE_DEFAULT)
 
     def get_stop_type(self, code):
-        if code is 0:
-            pickup_type = self.GTFS.Regular
-        elif code is 1:
-            pickup_type = self.GTFS.NotAvailable
-        elif code is 2:
-            pickup_type = self.GTFS.MustPhone
-        elif code is 3:
-            pickup_type = self.GTFS.MustCoordinateWithDriver
-        else:
-            pickup_type = self.GTFS.NotAvailable
-        return pickup_type
+        return self.STOP_TYPES.get(code, self.STOP_TYPES_DEFAULT)
 
     def get_payment_method(self, code):
-        if code is "0":
-            return self.GTFS.OnBoard
-        else:
-            return self.GTFS.BeforeBoarding
+        return self.PAYMENT_METHODS.get(code, self.PAYMENT_METHODS_DEFAULT)
 
     def get_transfers(self, code):
-        if int(code) is 0:
-            return self.GTFS.NoTransfersAllowed
-        elif int(code) is 1:
-            return self.GTFS.OneTransfersAllowed
-        elif int(code) is 2:
-            return self.GTFS.TwoTransfersAllowed
-        else:
-            return self.GTFS.UnlimitedTransfersAllowed
+        return self.TRANSFERS.get(code, self.TRANSFERS_DEFAULT)
 
     def get_transfer_type(self, code):
-        if int(code) == 3:
-            return self.GTFS.NoTransfer
-        elif int(code) is 1:
-            return self.GTFS.EnsuredTransfer
-        elif int(code) is 2:
-            return self.GTFS.MinimumTimeTransfer
-        else:
-            return self.GTFS.RecommendedTransfer
+        return self.TRANSFER_TYPES.get(code, self.TRANSFER_TYPES_DEFAULT)
 
-    @staticmethod
-    def get_bikes_allowed(code):
-        bikes = 0
-        if code is "0" or "2":
-            bikes = 0
-        elif code is "1":
-            bikes = 1
-        return Literal(bikes, datatype=XSD.boolean)
+    @classmethod
+    def get_bikes_allowed(cls, code):
+        return cls.BIKES_ALLOWED.get(code, cls.BIKES_ALLOWED_DEFAULT)
+
+    def get_literal(self, value, datatype=None):
+        """Returns Literal(value, datatype=datatype), reusing the one made last time value was seen."""
+        return self.__cached_literal((value, datatype), lambda: Literal(value, datatype=datatype))
+
+    def get_distance_literal(self, distance):
+        return self.__cached_literal((distance, float), lambda: Literal(float(distance)))
 
     @staticmethod
     def get_date_literal(date):
         return Literal(datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d"), datatype=XSD.date)
 
+    def __date_literal(self, date):
+        return self.__cached_literal((date, datetime), lambda: self.get_date_literal(date))
+
+    def __cached_literal(self, key, make_literal):
+        # literals are immutable, so the same few thousand times, dates and sequence numbers repeated over millions
+        # of rows can share one Literal each
+        literal = self.literals.get(key)
+        if literal is None:
+            literal = make_literal()
+            self.literals.put(key, literal)
+        return literal
+
+
+class GtfsDelta:
+    """Converts only the rows that differ between two versions of a feed, giving the triples to remove and add.
+
+    Rows are compared by fingerprint, so a changed row counts as one removed and one added row. The identifier
+    triples of trips, stops, routes etc., and the type they are given when first seen, are never removed, as
+    unchanged rows may still refer to them. options are passed on to GtfsCsvToRdf, e.g. to compare filtered feeds.
+    """
+
+    def __init__(self, uri, previous, current, **options):
+        self.uri = uri
+        self.previous = previous
+        self.current = current
+        self.options = options
+        self.changes = {}
+        self.removed = None
+        self.added = None
+
+    def convert(self):
+        old_rows = GtfsCsvToRdf(self.uri, None, **self.options).fingerprint_source(self.previous)
+        new_rows = GtfsCsvToRdf(self.uri, None, **self.options).fingerprint_source(self.current)
+        removed = {filename: rows - new_rows.get(filename, set()) for filename, rows in old_rows.items()}
+        added = {filename: rows - old_rows.get(filename, set()) for filename, rows in new_rows.items()}
+        for filename in set(removed) | set(added):
+            self.changes[filename] = {"removed": len(removed.get(filename, ())), "added": len(added.get(filename, ()))}
+            if filename in self.__whole_files() and (removed.get(filename) or added.get(filename)):
+                # what one row gives depends on the rows around it, so the whole file is compared instead
+                removed[filename] = old_rows.get(filename, set())
+                added[filename] = new_rows.get(filename, set())
+        old_graph = self.__convert_rows(self.previous, removed)
+        new_graph = self.__convert_rows(self.current, added)
+        self.removed = Graph(identifier=self.uri)
+        for triple in old_graph.graph - new_graph.graph:
+            subject, predicate, obj = triple
+            key = subject[len(self.uri):] if subject.startswith(self.uri) else None
+            if key in old_graph.entities.entries and (predicate == DCTERMS.identifier or predicate == RDF.type
+                                                      and obj == GtfsCsvToRdf.entity_type(key)):
+                continue
+            self.removed.add(triple)
+        self.added = new_graph.graph - old_graph.graph
+        return self.changes
+
+    def __whole_files(self):
+        # fare rules are numbered in file order, and a WKT shape is made from all of its rows
+        if self.options.get("shape_geometry") == "wkt":
+            return "fare_rules.txt", "shapes.txt"
+        return "fare_rules.txt",
+
+    def __convert_rows(self, source, changed):
+        convertor = GtfsCsvToRdf(self.uri, None, **self.options)
+        for filename, rows in changed.items():
+            convertor.row_filters[filename] = lambda row, rows=rows: GtfsCsvToRdf.fingerprint(row) in rows
+        convertor.convert_source(source, [filename for filename, rows in changed.items() if rows])
+        return convertor
+
+    def output(self, remove_file, add_file):
+        for graph, destination in ((self.removed, remove_file), (self.added, add_file)):
+            with open(destination, "w", encoding="utf-8") as lines:
+                for triple in graph:
+                    lines.write(self.__line(triple))
+
+    def output_sparql(self, destination, graph_uri=None):
+        with open(destination, "w", encoding="utf-8") as update:
+            for operation, graph in (("DELETE DATA", self.removed), ("INSERT DATA", self.added)):
+                if operation == "INSERT DATA":
+                    update.write(";\n")
+                update.write(operation + " {\n")
+                if graph_uri is not None:
+                    update.write("GRAPH %s {\n" % URIRef(graph_uri).n3())
+                for triple in graph:
+                    update.write(self.__line(triple))
+                if graph_uri is not None:
+                    update.write("}\n")
+                update.write("}\n")
+
+    @staticmethod
+    def __line(triple):
+        subject, predicate, obj = triple
+        return "%s %s %s .\n" % (subject.n3(), predicate.n3(), TripleStream.term(obj))
+
+
+class GtfsBatch:
+    """Converts many feeds, each to its own output file and named graph, in its own worker process.
+
+    feeds is a directory of GTFS zip files (or feed directories), or a JSON manifest listing them, either as paths or
+    as objects with a "source" and optionally "name", "uri", "graph" and "output_file". Each feed's URI defaults to
+    uri followed by its name and a slash, its graph to its URI and its output to output_dir/name.<format>. A relative
+    source is relative to the manifest, and a relative output_file to output_dir.
+    """
+
+    EXTENSIONS = {"turtle": "ttl", "nquads": "nq", "xml": "rdf", "pretty-xml": "rdf", "json-ld": "jsonld"}
+
+    def __init__(self, uri, output_dir, feeds, processes=None, **options):
+        self.uri = uri
+        self.output_dir = output_dir
+        self.feeds = feeds
+        self.processes = processes
+        self.options = options
+        self.reports = []
+
+    def list_feeds(self):
+        if os.path.isdir(self.feeds):
+            entries = [name for name in sorted(os.listdir(self.feeds))
+                       if name.endswith(".zip") or os.path.isdir(os.path.join(self.feeds, name))]
+            base_dir = self.feeds
+        else:
+            with open(self.feeds) as manifest:
+                entries = json.load(manifest)
+            base_dir = os.path.dirname(os.path.abspath(self.feeds))
+        serialize = self.options.get("serialize", "n3")
+        feeds = []
+        for entry in entries:
+            feed = {"source": entry} if isinstance(entry, str) else dict(entry)
+            feed["source"] = os.path.join(base_dir, feed["source"])
+            feed.setdefault("name", os.path.splitext(os.path.basename(os.path.normpath(feed["source"])))[0])
+            feed.setdefault("uri", self.uri + feed["name"] + "/")
+            feed.setdefault("graph", feed["uri"])
+            # a relative output file is in output_dir, just as a relative source is next to the manifest
+            feed["output_file"] = os.path.join(self.output_dir, feed.get("output_file") or "%s.%s" % (
+                feed["name"], self.EXTENSIONS.get(serialize, serialize)))
+            feeds.append(feed)
+        names = [feed["name"] for feed in feeds]
+        duplicates = sorted(set(name for name in names if names.count(name) > 1))
+        if duplicates:
+            raise ValueError("feed names must be unique, found %s more than once" % ", ".join(duplicates))
+        return feeds
+
+    def convert(self):
+        """Converts every feed and returns a report per feed, in the order the feeds are listed."""
+        feeds = self.list_feeds()
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.options.get("checkpoint") is not None:
+            os.makedirs(self.options["checkpoint"], exist_ok=True)
+        reports = {}
+        # the biggest feeds are started first so that a large one is not left running alone at the end
+        waiting = sorted(feeds, key=lambda feed: self.__size(feed["source"]), reverse=True)
+        # a process per feed rather than a shared pool, which a single worker dying would break for every feed
+        running = {}
+        while waiting or running:
+            while waiting and len(running) < (self.processes or os.cpu_count() or 1):
+                feed = waiting.pop(0)
+                options = dict(self.options)
+                if options.get("store_path") is not None:
+                    options["store_path"] = os.path.join(options["store_path"], feed["name"])
+                if options.get("checkpoint") is not None:
+                    options["checkpoint"] = os.path.join(options["checkpoint"], feed["name"] + ".json")
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=_send_feed_report, args=(feed, options, sender),
+                                                  name="gtfs-feed-%s" % feed["name"])
+                process.start()
+                sender.close()
+                running[receiver] = (feed, process)
+            for receiver in wait(list(running)):
+                feed, process = running.pop(receiver)
+                try:
+                    report = receiver.recv()
+                except EOFError:
+                    # the worker process itself died, e.g. killed for running out of memory
+                    process.join()
+                    report = dict(feed, status="error", error="worker process exited with code %s" % process.exitcode)
+                receiver.close()
+                process.join()
+                reports[feed["name"]] = report
+                logger.info("%s: %s in %.1fs", feed["name"], report["status"], report.get("seconds", 0.0))
+        self.reports = [reports[feed["name"]] for feed in feeds]
+        return self.reports
+
+    def summary(self):
+        failed = [report["name"] for report in self.reports if report["status"] != "ok"]
+        return {"feeds": len(self.reports), "converted": len(self.reports) - len(failed), "failed": failed,
+                "rows": sum(report.get("rows", 0) for report in self.reports),
+                "triples": sum(report.get("triples", 0) for report in self.reports),
+                "seconds": sum(report.get("seconds", 0.0) for report in self.reports)}
+
+    @staticmethod
+    def __size(source):
+        if os.path.isdir(source):
+            return sum(os.path.getsize(os.path.join(source, name)) for name in os.listdir(source))
+        return os.path.getsize(source) if os.path.exists(source) else 0
+
+
 if __name__ == "__main__":
-    print(sys.argv)
-    GtfsCsvToRdf(uri=sys.argv[1], output_file=sys.argv[2], zip_file=sys.argv[3])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Convert a GTFS zip file to Linked GTFS")
+    parser.add_argument("uri", help="URI that entities will be prefixed with")
+    parser.add_argument("output_file", help="destination file for the generated Linked GTFS")
+    parser.add_argument("zip_file", help="zip file containing the GTFS data")
+    parser.add_argument("--format", default="n3", help="rdflib serialization format (default: n3)")
+    parser.add_argument("--graph", help="named graph of nquads output and of the --previous SPARQL Update "
+                                        "(default: URI for nquads, the default graph otherwise)")
+    parser.add_argument("--stream", action="store_true",
+                        help="write triples as they are converted instead of building a graph in memory, "
+                             "needs --format nt or nquads")
+    parser.add_argument("--entity-cache-size", type=int,
+                        help="most trips, stops, routes etc. to keep interned (default: no limit)")
+    parser.add_argument("--literal-cache-size", type=int, default=1 << 16,
+                        help="most times, dates, sequence numbers etc. to keep built literals of (default: 65536)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes to convert stop_times.txt and shapes.txt with (default: 1)")
+    parser.add_argument("--engine", choices=GtfsCsvToRdf.ENGINES, default="rows",
+                        help="columnar converts stop_times.txt and shapes.txt in column batches with pyarrow, "
+                             "needs --stream")
+    parser.add_argument("--store", help="persistent rdflib store plugin to build the graph in, e.g. Oxigraph or "
+                                        "BerkeleyDB (use --format nt to serialize it without loading it into memory)")
+    parser.add_argument("--store-path", help="where the persistent store keeps its data")
+    parser.add_argument("--batch-size", type=int, default=10000,
+                        help="triples added to the persistent store per commit (default: 10000)")
+    parser.add_argument("--compress", choices=tuple(PartWriter.COMPRESSIONS),
+                        help="compress the output, zstd needs the zstandard package")
+    parser.add_argument("--compress-level", type=int, help="compression level (default: 6 for gzip, 3 for zstd)")
+    parser.add_argument("--part-bytes", type=int,
+                        help="split nt/nquads output into numbered parts of at most this many uncompressed bytes, "
+                             "listed in OUTPUT_FILE's .manifest.json")
+    parser.add_argument("--part-triples", type=int,
+                        help="split nt/nquads output into numbered parts of at most this many triples")
+    parser.add_argument("--sort", action="store_true",
+                        help="with --stream, sort the output and drop duplicate triples, using temporary files "
+                             "next to OUTPUT_FILE")
+    parser.add_argument("--sort-memory", type=int, default=1 << 28,
+                        help="bytes of lines to sort in memory at a time with --sort (default: 268435456)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="read rows and, with --stream, format and write triples on their own threads, "
+                             "reporting how busy each stage is in --stats")
+    parser.add_argument("--agency", action="append", dest="agencies", metavar="AGENCY_ID",
+                        help="only convert the routes and trips of this agency, may be given more than once")
+    parser.add_argument("--route", action="append", dest="routes", metavar="ROUTE_ID",
+                        help="only convert this route and its trips, may be given more than once")
+    parser.add_argument("--start-date", metavar="YYYYMMDD",
+                        help="only convert trips whose service runs on this day or later")
+    parser.add_argument("--end-date", metavar="YYYYMMDD",
+                        help="only convert trips whose service runs on this day or earlier")
+    parser.add_argument("--checkpoint", metavar="FILE",
+                        help="with --stream, record progress in FILE and resume from it if it exists, e.g. after "
+                             "the process was killed; removed once the conversion completes. With --batch, FILE is "
+                             "a directory holding one for each feed")
+    parser.add_argument("--checkpoint-interval", type=int, default=100000,
+                        help="rows between checkpoints within a file (default: 100000)")
+    parser.add_argument("--shape-geometry", choices=GtfsCsvToRdf.SHAPE_GEOMETRIES, default="points",
+                        help="wkt writes each shape as one GeoSPARQL WKT LineString instead of a resource per point")
+    parser.add_argument("--shape-precision", type=int,
+                        help="with --shape-geometry wkt, decimal places to round coordinates to")
+    parser.add_argument("--stats", action="store_true", help="print conversion statistics as JSON when done")
+    parser.add_argument("--stats-file", help="write conversion statistics as JSON to this file when done")
+    parser.add_argument("--progress-interval", type=int, default=100000,
+                        help="rows between progress log lines (default: 100000)")
+    parser.add_argument("--profile-dir", help="write a cProfile file for each stage to this directory")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="record the Python memory allocated by each stage with tracemalloc")
+    parser.add_argument("--log-level", default="WARNING", help="logging level, INFO shows progress (default: WARNING)")
+    parser.add_argument("--batch", action="store_true",
+                        help="convert many feeds: ZIP_FILE is a directory of GTFS zip files or a JSON manifest of them "
+                             "and OUTPUT_FILE the directory to write each feed's output to")
+    parser.add_argument("--processes", type=int,
+                        help="with --batch, feeds converted at the same time (default: one per CPU)")
+    parser.add_argument("--report", help="with --batch, where to write the JSON report of each feed's time and "
+                                         "errors (default: OUTPUT_FILE/batch_report.json)")
+    parser.add_argument("--previous", metavar="ZIP_FILE",
+                        help="previous version of the feed; only the triples to remove and add are written")
+    parser.add_argument("--patch", choices=("sparql", "nt"), default="sparql",
+                        help="with --previous, write one SPARQL Update (default) or OUTPUT_FILE.remove.nt "
+                             "and OUTPUT_FILE.add.nt")
+    args = parser.parse_args()
+    if args.batch and args.graph is not None:
+        parser.error("--graph cannot be used with --batch, where each feed has its own graph")
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s")
+    options = dict(serialize=args.format, stream=args.stream, entity_cache_size=args.entity_cache_size,
+                   literal_cache_size=args.literal_cache_size, workers=args.workers, engine=args.engine,
+                   store=args.store, store_path=args.store_path, batch_size=args.batch_size,
+                   progress_interval=args.progress_interval, compression=args.compress,
+                   compression_level=args.compress_level, part_bytes=args.part_bytes, part_triples=args.part_triples,
+                   shape_geometry=args.shape_geometry, shape_precision=args.shape_precision, sort_output=args.sort,
+                   sort_memory=args.sort_memory, pipeline=args.pipeline, agencies=args.agencies, routes=args.routes,
+                   start_date=args.start_date, end_date=args.end_date, checkpoint=args.checkpoint,
+                   checkpoint_interval=args.checkpoint_interval)
+    if args.previous is not None:
+        delta = GtfsDelta(args.uri, args.previous, args.zip_file, shape_geometry=args.shape_geometry,
+                          shape_precision=args.shape_precision, agencies=args.agencies, routes=args.routes,
+                          start_date=args.start_date, end_date=args.end_date)
+        print(json.dumps(delta.convert(), indent=2, sort_keys=True))
+        if args.patch == "sparql":
+            # a feed converted to anything but N-Quads is loaded into the default graph, which the patch must target
+            graph = args.uri if args.graph is None and args.format == "nquads" else args.graph
+            delta.output_sparql(args.output_file, graph)
+        else:
+            delta.output(args.output_file + ".remove.nt", args.output_file + ".add.nt")
+    elif args.batch:
+        batch = GtfsBatch(args.uri, args.output_file, args.zip_file, args.processes, **options)
+        reports = batch.convert()
+        report_file = args.report or os.path.join(args.output_file, "batch_report.json")
+        with open(report_file, "w") as report:
+            json.dump({"summary": batch.summary(), "feeds": reports}, report, indent=2)
+        print(json.dumps(batch.summary(), indent=2))
+        sys.exit(1 if batch.summary()["failed"] else 0)
+    else:
+        convertor = GtfsCsvToRdf(uri=args.uri, output_file=args.output_file, zip_file=args.zip_file,
+                                 graph_uri=args.graph, profile_dir=args.profile_dir, trace_memory=args.trace_memory, **options)
+        if args.stats:
+            print(json.dumps(convertor.stats(), indent=2))
+        if args.stats_file is not None:
+            with open(args.stats_file, "w") as stats_file:
+                json.dump(convertor.stats(), stats_file, indent=2)
@@ -0,0 +1,269 @@
+import csv
+import json
+import os
+import shutil
+
+from rdflib import Literal, RDF, URIRef, XSD
+from benchmark import write_feed
+import gtfs_csv_to_rdf
+from gtfs_csv_to_rdf import GtfsBatch, GtfsCsvToRdf, GtfsDelta, PartWriter
+
+URI = "http://example.com/gtfs#"
+
+
+def feed_dir(tmp_path, stop_times_rows=2000):
+    path = str(tmp_path / "feed")
+    write_feed(path, stop_times_rows)
+    return path
+
+
+def convert(source, output_file, **options):
+    convertor = GtfsCsvToRdf(URI, output_file, serialize="nt", stream=True, **options)
+    convertor.open_zip(source)
+    with open(output_file, "rb") as output:
+        return output.read()
+
+
+def test_parallel_chunks_match_serial(tmp_path):
+    source = feed_dir(tmp_path)
+    zip_source = shutil.make_archive(str(tmp_path / "feed"), "zip", source)
+    serial = convert(source, str(tmp_path / "serial.nt"))
+    assert convert(source, str(tmp_path / "parallel.nt"), workers=3) == serial
+    assert convert(zip_source, str(tmp_path / "parallel_zip.nt"), workers=3) == serial
+    assert not [name for name in os.listdir(str(tmp_path)) if name.startswith("gtfs_shards_")]
+
+
+def read_parts(root):
+    with open(os.path.splitext(root)[0] + ".manifest.json") as manifest:
+        parts = json.load(manifest)["parts"]
+    contents = []
+    for part in parts:
+        with open(os.path.join(os.path.dirname(root), part["path"]), "rb") as part_file:
+            contents.append(part_file.read())
+    return parts, contents
+
+
+def test_parts_never_split_a_line(tmp_path):
+    for options, writes, expected in (
+            ({"part_triples": 2}, [b"a1\nb2\nc3", b"33\nd4\n"], [b"a1\nb2\n", b"c333\nd4\n"]),
+            ({"part_bytes": 6}, [b"a1\nb2\nc3", b"33\nd4\n"], [b"a1\nb2\n", b"c333\n", b"d4\n"]),
+            ({"part_bytes": 8}, [b"a1\nb2\nc3", b"33\nd4\n"], [b"a1\nb2\n", b"c333\nd4\n"])):
+        root = str(tmp_path / ("out_%s_%d.nt" % next(iter(options.items()))))
+        output = PartWriter(root, **options)
+        for data in writes:
+            output.write(data)
+        output.close()
+        parts, contents = read_parts(root)
+        assert contents == expected
+        assert [part["triples"] for part in parts] == [content.count(b"\n") for content in expected]
+
+
+def test_batch_survives_a_dying_worker(tmp_path, monkeypatch):
+    feeds = tmp_path / "feeds"
+    for name in ("a", "b", "c"):
+        write_feed(str(feeds / name), 100)
+    (feeds / "bad.zip").write_bytes(b"not a zip file")
+    convert_feed = gtfs_csv_to_rdf._convert_feed
+
+    def crash_on_b(feed, options):
+        if feed["name"] == "b":
+            os._exit(9)
+        return convert_feed(feed, options)
+
+    # worker processes are forked, so they see the patched function
+    monkeypatch.setattr(gtfs_csv_to_rdf, "_convert_feed", crash_on_b)
+    batch = GtfsBatch(URI, str(tmp_path / "out"), str(feeds), processes=1, serialize="nt", stream=True)
+    reports = {report["name"]: report for report in batch.convert()}
+    assert [reports[name]["status"] for name in ("a", "b", "bad", "c")] == ["ok", "error", "error", "ok"]
+    assert reports["b"]["error"] == "worker process exited with code 9"
+    assert os.path.getsize(str(tmp_path / "out" / "c.nt")) > 0
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_checkpoint_resumes_to_the_same_output(tmp_path):
+    source = feed_dir(tmp_path)
+    expected = convert(source, str(tmp_path / "expected.nt"))
+    output_file, checkpoint = str(tmp_path / "out.nt"), str(tmp_path / "state.json")
+
+    def interrupt(progress):
+        if progress["file"] == "stop_times.txt" and progress["rows"] >= 1500:
+            raise Interrupted()
+
+    convertor = GtfsCsvToRdf(URI, output_file, serialize="nt", stream=True, checkpoint=checkpoint,
+                             checkpoint_interval=400, progress=interrupt, progress_interval=100)
+    try:
+        convertor.convert_directory(source)
+    except Interrupted:
+        pass
+    try:
+        GtfsCsvToRdf(URI + "other/", output_file, serialize="nt", stream=True, checkpoint=checkpoint)
+    except ValueError as error:
+        assert "uri" in str(error)
+    else:
+        raise AssertionError("resumed with a different uri")
+    assert convert(source, output_file, checkpoint=checkpoint, checkpoint_interval=400) == expected
+    assert not os.path.exists(checkpoint)
+
+
+def edit_rows(path, edit):
+    with open(path, newline="", encoding="utf-8") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    with open(path, "w", newline="", encoding="utf-8") as csv_file:
+        csv_writer = csv.DictWriter(csv_file, fieldnames=list(rows[0]))
+        csv_writer.writeheader()
+        csv_writer.writerows(edit(rows))
+
+
+def graph_of(source, **options):
+    convertor = GtfsCsvToRdf(URI, None, **options)
+    convertor.convert_source(source)
+    return set(convertor.graph)
+
+
+def test_delta_patch_gives_the_new_graph(tmp_path):
+    previous = str(tmp_path / "previous")
+    write_feed(previous, 4000)
+
+    def station(rows):
+        rows[0]["location_type"] = "1"
+        return rows
+
+    def reroute(rows):
+        rows[1]["route_id"] = rows[0]["route_id"]
+        return rows
+
+    def move_point(rows):
+        rows[1]["shape_pt_lat"] = "53.0"
+        return rows
+
+    for filename, edit, options in (("stops.txt", station, {}), ("fare_rules.txt", reroute, {}),
+                                    ("shapes.txt", move_point, {"shape_geometry": "wkt"})):
+        current = str(tmp_path / filename)
+        shutil.copytree(previous, current)
+        edit_rows(os.path.join(current, filename), edit)
+        delta = GtfsDelta(URI, previous, current, **options)
+        delta.convert()
+        assert (graph_of(previous, **options) - set(delta.removed)) | set(delta.added) == graph_of(current, **options)
+
+
+def test_columnar_engine_matches_rows(tmp_path, monkeypatch):
+    source = feed_dir(tmp_path, 3000)
+    with open(os.path.join(source, "stop_times.txt"), "a", encoding="utf-8") as stop_times:
+        stop_times.write('T1,"08:05:00", 08:05:00,S1,41,0,,\n'
+                         'T1, 08:06:00,08:06:00 ,S2, 42,1, 2,1.5\n'
+                         '\n'
+                         'T1,08:07:00,08:07:00,"S3",43,,3,\n')
+    rows = convert(source, str(tmp_path / "rows.nt"))
+    assert convert(source, str(tmp_path / "columnar.nt"), engine="columnar") == rows
+    # quoted values after spaces, which only the csv module unquotes, first appear after a few batches
+    monkeypatch.setattr(gtfs_csv_to_rdf.ColumnarEngine, "BLOCK_SIZE", 1 << 14)
+    for line in ('T1,08:09:00,08:09:00, "S4",44,0,0,2.5\n', 'T1,08:10:00,08:10:00,S5,45,0, "a, b",\n'):
+        with open(os.path.join(source, "stop_times.txt"), "a", encoding="utf-8") as stop_times:
+            stop_times.write(line + 'T2,08:11:00,08:11:00,S6,46,0,0,\n')
+        rows = convert(source, str(tmp_path / "rows.nt"))
+        assert convert(source, str(tmp_path / "columnar.nt"), engine="columnar") == rows
+
+
+GTFS = GtfsCsvToRdf.GTFS
+TRUE, FALSE = Literal(True, datatype=XSD.boolean), Literal(False, datatype=XSD.boolean)
+LOOKUPS = (
+    ("get_wheelchair_accessible", {"": GTFS.CheckParentStation, "0": GTFS.CheckParentStation,
+                                   "1": GTFS.WheelchairAccessible, "2": GTFS.NotWheelchairAccessible}),
+    ("get_stop_type", {"": GTFS.Regular, "0": GTFS.Regular, "1": GTFS.NotAvailable, "2": GTFS.MustPhone,
+                       "3": GTFS.MustCoordinateWithDriver}),
+    ("get_payment_method", {"": GTFS.BeforeBoarding, "0": GTFS.OnBoard, "1": GTFS.BeforeBoarding}),
+    ("get_transfers", {"": GTFS.UnlimitedTransfersAllowed, "0": GTFS.NoTransfersAllowed,
+                       "1": GTFS.OneTransfersAllowed, "2": GTFS.TwoTransfersAllowed}),
+    ("get_transfer_type", {"": GTFS.RecommendedTransfer, "0": GTFS.RecommendedTransfer, "1": GTFS.EnsuredTransfer,
+                           "2": GTFS.MinimumTimeTransfer, "3": GTFS.NoTransfer}),
+    ("get_bikes_allowed", {"": FALSE, "0": FALSE, "1": TRUE, "2": FALSE}))
+
+
+def test_lookup_tables():
+    convertor = GtfsCsvToRdf(URI, None)
+    for method, expected in LOOKUPS:
+        assert {code: getattr(convertor, method)(code) for code in expected} == expected, method
+
+
+def write_files(path, files):
+    os.makedirs(path)
+    for filename, text in files.items():
+        with open(os.path.join(path, filename), "w", encoding="utf-8") as csv_file:
+            csv_file.write(text)
+
+
+def test_converted_codes(tmp_path):
+    source = str(tmp_path / "feed")
+    write_files(source, {
+        "stops.txt": "stop_id,stop_name,stop_lat,stop_lon,location_type\nS1,One,53.3,-6.2,1\nS2,Two,53.3,-6.2,\n",
+        "trips.txt": "route_id,service_id,trip_id,bikes_allowed\nR1,WK,T1,1\nR1,WK,T2,2\n",
+        "stop_times.txt": "trip_id,arrival_time,departure_time,stop_id,stop_sequence,pickup_type,drop_off_type\n"
+                          "T1,08:00:00,08:00:00,S2,1,2,\n",
+        "calendar_dates.txt": "service_id,date,exception_type\nWK,20260101,1\nWK,20260102,2\n",
+        "fare_attributes.txt": "fare_id,price,currency_type,payment_method,transfers\nF1,2.00,EUR,0,\n"})
+    convertor = GtfsCsvToRdf(URI, None)
+    convertor.convert_source(source)
+    graph = convertor.graph
+
+    def value(subject, predicate):
+        return graph.value(URIRef(URI + subject), predicate)
+
+    assert set(graph.objects(URIRef(URI + "stop_S1"), RDF.type)) == {GTFS.Station}
+    assert set(graph.objects(URIRef(URI + "stop_S2"), RDF.type)) == {GTFS.Stop}
+    assert value("trip_T1", GTFS.bikesAllowed) == TRUE
+    assert value("trip_T2", GTFS.bikesAllowed) == FALSE
+    assert value("T1_S2_StopTime_1", GTFS.pickupType) == GTFS.MustPhone
+    assert value("T1_S2_StopTime_1", GTFS.dropOffType) == GTFS.Regular
+    assert value("WK_cal_20260101", GTFS.dateAddition) == TRUE
+    assert value("WK_cal_20260102", GTFS.dateAddition) == FALSE
+    assert value("fare_F1", GTFS.transfers) == GTFS.UnlimitedTransfersAllowed
+    assert value("fare_F1", GTFS.paymentMethod) == GTFS.OnBoard
+
+
+def test_batch_manifest_paths(tmp_path, monkeypatch):
+    write_feed(str(tmp_path / "feeds" / "a"), 100)
+    (tmp_path / "manifests").mkdir()
+    manifest = tmp_path / "manifests" / "feeds.json"
+    manifest.write_text(json.dumps([{"source": "../feeds/a", "output_file": "x.nt"}]))
+    monkeypatch.chdir(str(tmp_path / "manifests"))
+    reports = GtfsBatch(URI, str(tmp_path / "out"), str(manifest), processes=1, serialize="nt",
+                        stream=True).convert()
+    assert [report["status"] for report in reports] == ["ok"]
+    assert os.path.getsize(str(tmp_path / "out" / "x.nt")) > 0
+    assert not os.path.exists("x.nt")
+
+
+def test_filters(tmp_path):
+    source = str(tmp_path / "feed")
+    write_files(source, {
+        "agency.txt": "agency_id,agency_name,agency_url,agency_timezone\nA1,One,http://example.com,Europe/Dublin\n",
+        # no agency_id, so the routes belong to the only agency
+        "routes.txt": "route_id,route_type\nR1,3\nR2,3\n",
+        "trips.txt": "route_id,service_id,trip_id\nR1,WEEKDAY,T1\nR1,EXTRA,T2\nR2,SUNDAY,T3\nR2,TUESDAY,T4\n",
+        "calendar.txt": "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n"
+                        "WEEKDAY,1,1,1,1,1,0,0,20260101,20261231\nSUNDAY,0,0,0,0,0,0,1,20260101,20261231\n"
+                        "TUESDAY,0,1,0,0,0,0,0,20260101,20261231\n",
+        # Tuesday 6 January is removed from TUESDAY, and EXTRA only runs on Wednesday 7 January
+        "calendar_dates.txt": "service_id,date,exception_type\nTUESDAY,20260106,2\nEXTRA,20260107,1\n",
+        "stop_times.txt": "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+                          "T1,08:00:00,08:00:00,S1,1\nT2,08:00:00,08:00:00,S1,1\nT3,08:00:00,08:00:00,S1,1\n"
+                          "T4,08:00:00,08:00:00,S1,1\n"})
+
+    def kept_trips(**filters):
+        convertor = GtfsCsvToRdf(URI, None, **filters)
+        convertor.resolve_filters(source)
+        return sorted(convertor.id_filters["trips.txt"][1])
+
+    assert kept_trips(start_date="20260105", end_date="20260107") == ["T1", "T2"]
+    assert kept_trips(start_date="20260105", end_date="20260106") == ["T1"]
+    assert kept_trips(start_date="20260110", end_date="20260111") == ["T3"]
+    assert kept_trips(agencies=["A1"]) == ["T1", "T2", "T3", "T4"]
+    assert kept_trips(agencies=["A2"]) == []
+    assert kept_trips(routes=["R2"], start_date="20260106", end_date="20260106") == []
+    # a convert_* method called on its own resolves the filters from the files next to its own
+    convertor = GtfsCsvToRdf(URI, None, routes=["R2"])
+    convertor.convert_stop_times(os.path.join(source, "stop_times.txt"))
+    assert sorted(str(trip)[len(URI):] for trip in convertor.graph.objects(None, GTFS.trip)) == ["trip_T3", "trip_T4"]